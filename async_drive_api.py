@@ -0,0 +1,185 @@
+import asyncio
+import json
+import time
+
+import aiohttp
+from googleapiclient.errors import HttpError
+from httplib2 import Response
+
+from google_drive_api import *
+
+# Maximum number of pooled HTTP connections kept open to the Google Drive API
+MAX_CONNECTIONS = 100
+# Number of seconds an idle pooled connection is kept alive
+KEEPALIVE_TIMEOUT = 60
+# Number of seconds to wait for a connection to be established or for data to be received
+CONNECT_TIMEOUT = 30
+READ_TIMEOUT = 300
+# Number of seconds before the access token expires at which it is refreshed
+TOKEN_REFRESH_MARGIN = 300
+
+
+def is_retryable_async_error(error):
+    """
+    Determines if a failed asyncio client request should be retried after a backoff delay
+    :param error: The exception raised by the failed request
+    :return: Boolean result of the determination
+    """
+    # Dropped connections, truncated responses and timeouts are always retried
+    if isinstance(error, (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError)):
+        return True
+    return is_retryable_error(error)
+
+
+class AsyncAPI:
+
+    def __init__(self, credentials, root_url=ROOT_URL, scheduler=None, max_connections=MAX_CONNECTIONS):
+        """
+        Initialize an asyncio Google Drive API client that sends its requests over a pool of keep-alive connections,
+        a single client can run hundreds of concurrent requests and must be used within a running event loop
+        :param credentials: Credentials used to connect to the Google Drive API
+        :param root_url: The root URL of the Google Drive API
+        :param scheduler: The request scheduler shared by all connections of this run, a new one is created if omitted
+        :param max_connections: The maximum number of concurrently open connections
+        """
+        self.credentials = credentials
+        self.scheduler = scheduler if scheduler else RequestScheduler()
+        self.max_connections = max_connections
+        self.api_url = root_url + DRIVE_API_PATH
+        self.session = None
+        self.access_token = None
+        self.token_expiry = 0
+        self.token_lock = None
+
+    async def __aenter__(self):
+        """
+        Opens the connection pool
+        :return: This client
+        """
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        """
+        Closes the connection pool
+        """
+        await self.close()
+
+    async def open(self):
+        """
+        Opens the connection pool, this must be called from the event loop in which the client is used
+        """
+        connector = aiohttp.TCPConnector(
+            limit=self.max_connections,
+            limit_per_host=self.max_connections,
+            keepalive_timeout=KEEPALIVE_TIMEOUT
+        )
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        self.token_lock = asyncio.Lock()
+
+    async def close(self):
+        """
+        Closes the connection pool
+        """
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    async def get_access_token(self):
+        """
+        Returns a valid OAuth access token, the token is cached and refreshed shortly before it expires
+        :return: The access token string
+        """
+        async with self.token_lock:
+            if self.access_token is None or time.monotonic() >= self.token_expiry:
+                # The credentials refresh the token with a blocking request, which must not block the event loop
+                loop = asyncio.get_running_loop()
+                token_info = await loop.run_in_executor(None, self.credentials.get_access_token)
+                self.access_token = token_info.access_token
+                expires_in = token_info.expires_in if token_info.expires_in is not None else 3600
+                self.token_expiry = time.monotonic() + max(expires_in - TOKEN_REFRESH_MARGIN, 0)
+            return self.access_token
+
+    async def execute(self, function, count=1, metric=API_REQUEST_SECONDS):
+        """
+        Awaits the provided request function within the rate limit, retrying it if it fails with a retryable error
+        :param function: The coroutine function that sends the request and returns its result
+        :param count: The number of requests sent by the function
+        :param metric: The name of the histogram in which the duration of each attempt is recorded
+        :return: The result of the function
+        """
+        attempt = 0
+        while True:
+            delay = self.scheduler.reserve(count)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            start_time = time.monotonic()
+            try:
+                result = await function()
+            except Exception as ex:
+                self.scheduler.record_request(metric, time.monotonic() - start_time, ex)
+                if attempt >= self.scheduler.max_retries or not is_retryable_async_error(ex):
+                    raise
+                await asyncio.sleep(self.scheduler.reserve_backoff(attempt, ex))
+                attempt += 1
+                continue
+            self.scheduler.record_request(metric, time.monotonic() - start_time)
+            return result
+
+    @staticmethod
+    async def raise_for_status(response):
+        """
+        Raises the same HttpError as the Google API client library if a response has an error status
+        :param response: The aiohttp response
+        """
+        if response.status >= 300:
+            content = await response.read()
+            headers = {key.lower(): value for key, value in response.headers.items()}
+            headers['status'] = response.status
+            raise HttpError(Response(headers), content, uri=str(response.url))
+
+    async def get_json(self, path, params=None):
+        """
+        Sends a GET request to the Google Drive API and returns the decoded JSON response
+        :param path: The path of the API resource relative to the Google Drive API URL
+        :param params: The query parameters of the request
+        :return: The decoded JSON response
+        """
+        async def send():
+            headers = {'Authorization': 'Bearer {}'.format(await self.get_access_token())}
+            async with self.session.get(self.api_url + path, params=params, headers=headers) as response:
+                await self.raise_for_status(response)
+                return json.loads(await response.read())
+
+        return await self.execute(send)
+
+    async def get_folder_by_id(self, resource_id):
+        """
+        Returns the default Google Drive Object metadata for the provided Google ID's associated object
+        :param resource_id: Google ID associated with the desired metadata
+        :return: Metadata map for the provided Google ID's associated object
+        """
+        return await self.get_json("files/{}".format(resource_id))
+
+    async def get_children_by_id(self, resource_id):
+        """
+        Returns an array of the file specific metadata and MIME type for all children of the the provided Google ID's
+        associated object
+        :param resource_id: Google ID associated with the desired children's parent object
+        :return: Metadata map array for the provided Google ID's associated object's children
+        """
+        files = []
+        params = {
+            'q': "'{}' in parents".format(resource_id),
+            'fields': "nextPageToken,files({})".format(','.join(FILE_FIELDS + [GOOGLE_FILE_MIMETYPE])),
+            'pageSize': PAGE_SIZE
+        }
+        while True:
+            result = await self.get_json("files", params)
+            files.extend(result['files'])
+            if 'nextPageToken' in result:
+                params['pageToken'] = result['nextPageToken']
+            else:
+                break
+        return files
@@ -0,0 +1,402 @@
+import collections
+import email.parser
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FOLDER_TYPE = "application/vnd.google-apps.folder"
+FILE_TYPE = "application/octet-stream"
+MODIFIED_TIME = "2021-01-01T10:00:00.000Z"
+# Size of the random pattern from which the contents of every synthetic file are taken
+PATTERN_SIZE = 1048576
+# Size of the blocks in which media responses are written
+WRITE_BLOCK_SIZE = 65536
+# Boundary of the multipart batch responses
+BATCH_BOUNDARY = "fake_drive_batch"
+
+
+class SyntheticContent:
+
+    def __init__(self, seed=0):
+        """
+        Initialize a generator of deterministic file contents, every file is a window into a repeated random pattern
+        so that huge files can be served without being held in memory
+        :param seed: The seed of the random pattern
+        """
+        generator = random.Random(seed)
+        pattern = generator.getrandbits(8 * PATTERN_SIZE).to_bytes(PATTERN_SIZE, "little")
+        # The pattern is doubled so that any window shorter than the pattern is a single slice
+        self.pattern = pattern + pattern
+
+    def read(self, file_offset, start, length):
+        """
+        Returns a byte range of a synthetic file
+        :param file_offset: The offset in the pattern at which the file starts
+        :param start: The first byte of the range
+        :param length: The length of the range
+        :return: The bytes of the range
+        """
+        chunks = []
+        position = (file_offset + start) % PATTERN_SIZE
+        while length > 0:
+            size = min(length, PATTERN_SIZE)
+            chunks.append(self.pattern[position:position + size])
+            position = (position + size) % PATTERN_SIZE
+            length -= size
+        return b''.join(chunks)
+
+    def md5(self, file_offset, size):
+        """
+        Calculates the MD5 checksum of a synthetic file
+        :param file_offset: The offset in the pattern at which the file starts
+        :param size: The size of the file
+        :return: The hexadecimal MD5 checksum string
+        """
+        md5hash = hashlib.md5()
+        for start in range(0, size, PATTERN_SIZE):
+            md5hash.update(self.read(file_offset, start, min(PATTERN_SIZE, size - start)))
+        return md5hash.hexdigest()
+
+
+class FakeDrive:
+
+    def __init__(self, seed=0):
+        """
+        Initialize an in-memory Google Drive holding a tree of folders and synthetic files
+        :param seed: The seed of the synthetic file contents
+        """
+        self.content = SyntheticContent(seed)
+        self.metadata = {}
+        self.children = collections.defaultdict(list)
+        # Offset in the content pattern of every file
+        self.offsets = {}
+        self.file_count = 0
+        self.total_size = 0
+
+    def add_folder(self, folder_id, name, parent_id=None):
+        """
+        Adds a folder to the drive
+        :param folder_id: The Google ID of the folder
+        :param name: The name of the folder
+        :param parent_id: The Google ID of the parent folder, or None for a root folder
+        """
+        self.metadata[folder_id] = {'id': folder_id, 'name': name, 'mimeType': FOLDER_TYPE}
+        if parent_id:
+            self.children[parent_id].append(folder_id)
+
+    def add_file(self, file_id, name, parent_id, size):
+        """
+        Adds a synthetic file to the drive
+        :param file_id: The Google ID of the file
+        :param name: The name of the file
+        :param parent_id: The Google ID of the parent folder
+        :param size: The size of the file in bytes
+        """
+        offset = self.file_count * 7919 % PATTERN_SIZE
+        self.offsets[file_id] = offset
+        self.metadata[file_id] = {
+            'id': file_id,
+            'name': name,
+            'mimeType': FILE_TYPE,
+            'md5Checksum': self.content.md5(offset, size),
+            'size': str(size),
+            'modifiedTime': MODIFIED_TIME
+        }
+        self.children[parent_id].append(file_id)
+        self.file_count += 1
+        self.total_size += size
+
+
+class FakeDriveServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, drive, latency=0.0, bandwidth=None, requests_per_second=None, error_rate=0.0):
+        """
+        Initialize a local HTTP server implementing the parts of the Google Drive v3 API used by the utility
+        :param drive: The fake drive served
+        :param latency: The number of seconds every request is delayed by
+        :param bandwidth: If provided, the maximum number of bytes per second sent by each media response
+        :param requests_per_second: If provided, the request quota above which requests are rejected as rate limited
+        :param error_rate: The fraction of requests that fail with a transient server error
+        """
+        super().__init__(('127.0.0.1', 0), FakeDriveHandler)
+        self.drive = drive
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.requests_per_second = requests_per_second
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.random = random.Random(0)
+        self.window_start = time.monotonic()
+        self.window_requests = 0
+        self.requests = 0
+        self.rejected_requests = 0
+        self.thread = None
+
+    @property
+    def root_url(self):
+        """
+        The root URL of the fake Google Drive API
+        """
+        return "http://127.0.0.1:{}/".format(self.server_address[1])
+
+    def start(self):
+        """
+        Starts serving requests in a background thread
+        :return: This server
+        """
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops serving requests and closes the server socket
+        """
+        self.shutdown()
+        self.server_close()
+
+    def admit(self):
+        """
+        Counts a request against the quota and decides if it fails
+        :return: The error status and reason of the request, or None if it succeeds
+        """
+        with self.lock:
+            self.requests += 1
+            if self.requests_per_second:
+                now = time.monotonic()
+                if now - self.window_start >= 1:
+                    self.window_start = now
+                    self.window_requests = 0
+                self.window_requests += 1
+                if self.window_requests > self.requests_per_second:
+                    self.rejected_requests += 1
+                    return 403, "userRateLimitExceeded"
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.rejected_requests += 1
+                return 503, "backendError"
+        return None
+
+
+class FakeDriveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        """
+        Disables the request log
+        """
+        pass
+
+    def do_GET(self):
+        """
+        Serves the files get, files get media, files list and changes endpoints
+        """
+        url = urllib.parse.urlparse(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        error = self.server.admit()
+        if error:
+            self.send_error_json(*error)
+            return
+        drive = self.server.drive
+        match = re.match(r'/drive/v3/files/([^/]+)$', url.path)
+        if match:
+            file_id = match.group(1)
+            if file_id not in drive.metadata:
+                self.send_error_json(404, "notFound")
+            elif query.get('alt') == 'media':
+                self.send_media(file_id)
+            else:
+                self.send_json(select_fields(drive.metadata[file_id], query.get('fields')))
+        elif url.path == '/drive/v3/files':
+            self.send_json(self.list_children(query))
+        elif url.path == '/drive/v3/changes/startPageToken':
+            self.send_json({'startPageToken': '1'})
+        elif url.path == '/drive/v3/changes':
+            # The fake drive does not change while it is served
+            self.send_json({'changes': [], 'newStartPageToken': query.get('pageToken', '1')})
+        else:
+            self.send_error_json(404, "notFound")
+
+    def do_POST(self):
+        """
+        Serves the batch endpoint, every sub-request is a files get request that counts against the quota and can fail
+        on its own
+        """
+        content = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if urllib.parse.urlparse(self.path).path != '/batch/drive/v3':
+            self.send_error_json(404, "notFound")
+            return
+        # Parse the multipart body with the content type header so that the parser finds the boundary
+        message = email.parser.BytesParser().parsebytes(
+            'Content-Type: {}\r\n\r\n'.format(self.headers['Content-Type']).encode() + content
+        )
+        parts = []
+        for part in message.get_payload():
+            request_line = part.get_payload().split('\n', 1)[0].strip()
+            status, body = self.get_batch_response(urllib.parse.urlparse(request_line.split(' ')[1]))
+            content_id = part['Content-ID'].replace('<', '<response-', 1)
+            parts.append(
+                '--{}\r\nContent-Type: application/http\r\nContent-ID: {}\r\n\r\n'
+                'HTTP/1.1 {} {}\r\nContent-Type: application/json\r\n\r\n{}\r\n'.format(
+                    BATCH_BOUNDARY, content_id, status, self.responses[status][0], json.dumps(body)
+                )
+            )
+        response = (''.join(parts) + '--{}--\r\n'.format(BATCH_BOUNDARY)).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'multipart/mixed; boundary={}'.format(BATCH_BOUNDARY))
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def get_batch_response(self, url):
+        """
+        Returns the response of a files get sub-request of a batch request
+        :param url: The parsed URL of the sub-request
+        :return: A tuple of the HTTP status code and the response body
+        """
+        error = self.server.admit()
+        if error:
+            return error[0], get_error_body(*error)
+        drive = self.server.drive
+        match = re.match(r'/drive/v3/files/([^/]+)$', url.path)
+        file_id = urllib.parse.unquote(match.group(1)) if match else None
+        if file_id not in drive.metadata:
+            return 404, get_error_body(404, "notFound")
+        return 200, select_fields(drive.metadata[file_id], dict(urllib.parse.parse_qsl(url.query)).get('fields'))
+
+    def list_children(self, query):
+        """
+        Returns a page of the children of a folder
+        :param query: The query parameters of the files list request
+        :return: The files list response
+        """
+        parent_id = re.match(r"'(.+)' in parents", query['q']).group(1)
+        children = self.server.drive.children.get(parent_id, [])
+        start = int(query.get('pageToken') or 0)
+        page_size = int(query.get('pageSize', 100))
+        fields = re.search(r'files\((.*)\)', query.get('fields', ''))
+        response = {'files': [
+            select_fields(self.server.drive.metadata[child_id], fields.group(1) if fields else None)
+            for child_id in children[start:start + page_size]
+        ]}
+        if start + page_size < len(children):
+            response['nextPageToken'] = str(start + page_size)
+        return response
+
+    def send_media(self, file_id):
+        """
+        Sends the contents of a file, or the byte range given in the range header, at the configured bandwidth
+        :param file_id: The Google ID of the file
+        """
+        drive = self.server.drive
+        size = int(drive.metadata[file_id]['size'])
+        start, end = 0, size - 1
+        status = 200
+        headers = {}
+        byte_range = self.headers.get('Range')
+        if byte_range:
+            first, last = byte_range.split('=')[1].split('-')
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+            if start >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{}'.format(size))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            status = 206
+            headers['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, size)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', FILE_TYPE)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        # Send the range in blocks, sleeping between blocks to stay within the bandwidth
+        bandwidth = self.server.bandwidth
+        start_time = time.monotonic()
+        sent = 0
+        offset = drive.offsets[file_id]
+        for block_start in range(start, end + 1, WRITE_BLOCK_SIZE):
+            length = min(WRITE_BLOCK_SIZE, end + 1 - block_start)
+            self.wfile.write(drive.content.read(offset, block_start, length))
+            sent += length
+            if bandwidth:
+                delay = sent / bandwidth - (time.monotonic() - start_time)
+                if delay > 0:
+                    time.sleep(delay)
+
+    def send_json(self, body, status=200):
+        """
+        Sends a JSON response
+        :param body: The response body
+        :param status: The HTTP status code
+        """
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def send_error_json(self, status, reason):
+        """
+        Sends a Google API error response
+        :param status: The HTTP status code
+        :param reason: The error reason
+        """
+        self.send_json(get_error_body(status, reason), status)
+
+
+def get_error_body(status, reason):
+    """
+    Returns the body of a Google API error response
+    :param status: The HTTP status code
+    :param reason: The error reason
+    :return: The error response body
+    """
+    return {'error': {'code': status, 'message': reason, 'errors': [{'reason': reason}]}}
+
+
+def select_fields(metadata, fields):
+    """
+    Returns the requested fields of a file, or the default fields of the Google Drive API if none are requested
+    :param metadata: The metadata of the file
+    :param fields: The comma separated field names
+    :return: The selected metadata
+    """
+    if not fields:
+        return {'kind': 'drive#file', 'id': metadata['id'], 'name': metadata['name'], 'mimeType': metadata['mimeType']}
+    return {field: metadata[field] for field in fields.split(',') if field in metadata}
+
+
+class StubCredentials:
+    """
+    Credentials that send requests without authorization, used in place of service account credentials
+    """
+    AccessToken = collections.namedtuple('AccessToken', ['access_token', 'expires_in'])
+
+    def authorize(self, http):
+        """
+        Returns the HTTP connection unchanged
+        :param http: The HTTP connection
+        :return: The HTTP connection
+        """
+        return http
+
+    def get_access_token(self, http=None):
+        """
+        Returns a fixed access token
+        :param http: Unused
+        :return: The access token information
+        """
+        return self.AccessToken('benchmark', 3600)
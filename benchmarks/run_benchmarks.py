@@ -0,0 +1,382 @@
+import argparse
+import csv
+import glob
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# The utility modules are imported from the repository root
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from fake_drive import FakeDriveServer, StubCredentials
+from synthetic_trees import BYTES_IN_MIB, ROOT_ID, TREES, build_tree
+
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, 'baseline.json')
+# Fraction by which a benchmark may be slower than the baseline before it is reported as a regression
+DEFAULT_TOLERANCE = 0.25
+# Number of records written by the report benchmark at scale 1
+REPORT_RECORDS = 100000
+# Maximum number of files of a tree downloaded by ID by the file download benchmark, enough for several batch requests
+FILE_DOWNLOAD_FILES = 250
+# Google ID that is not in any synthetic tree, looked up by the file download benchmark to check that a failed lookup
+# is reported
+MISSING_ID = "missing"
+# Number of files per shard and seconds between shard queue checks of the distributed download benchmark, smaller than
+# the defaults so that the synthetic trees are spread over the workers and the wait for the last shard is short
+DISTRIBUTED_SHARD_FILES = 100
+DISTRIBUTED_POLL_INTERVAL = 0.1
+
+
+def parse_arguments():
+    """
+    Defines the accepted command line argument inputs and syntax then generates an argument parser
+    :return: The generated argument parser
+    """
+    parser = argparse.ArgumentParser(description="Benchmarks the utility against a local fake Google Drive server")
+    parser.add_argument("--trees", help="Synthetic trees to benchmark", choices=list(TREES), nargs='+',
+                        default=list(TREES))
+    parser.add_argument("--scale", help="Multiplier of the synthetic tree sizes", type=float, default=1.0)
+    parser.add_argument("--latency", help="Seconds every fake server request is delayed by", type=float,
+                        default=0.01)
+    parser.add_argument("--bandwidth", help="Maximum MiB per second sent by each fake server media response, 0 for "
+                                            "unlimited", type=float, default=100)
+    parser.add_argument("--server-quota", help="Requests per second above which the fake server rate limits "
+                                               "requests, 0 for unlimited", type=int, default=0)
+    parser.add_argument("--error-rate", help="Fraction of fake server requests that fail with a transient error",
+                        type=float, default=0.0)
+    parser.add_argument("-w", "--workers", help="Number of workers used by the utility", type=int, default=8)
+    parser.add_argument("--hosts", help="Number of worker processes of the distributed download, each with the "
+                                        "specified number of workers", type=int, default=2)
+    parser.add_argument("-r", "--requests-per-minute", help="Request quota used by the utility", type=int,
+                        default=12000)
+    parser.add_argument("--repeat", help="Number of times each benchmark is run, the fastest run is kept", type=int,
+                        default=1)
+    parser.add_argument("--baseline", help="Baseline results file", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", help="Save the results as the new baseline", action='store_true')
+    parser.add_argument("--tolerance", help="Fraction by which a benchmark may be slower than the baseline",
+                        type=float, default=DEFAULT_TOLERANCE)
+    return parser.parse_args()
+
+
+def get_config(args):
+    """
+    Returns the settings that must match for results to be comparable with a baseline
+    :param args: The command line arguments
+    :return: The map of settings
+    """
+    return {
+        'scale': args.scale,
+        'latency': args.latency,
+        'bandwidth': args.bandwidth,
+        'server_quota': args.server_quota,
+        'error_rate': args.error_rate,
+        'workers': args.workers,
+        'hosts': args.hosts,
+        'requests_per_minute': args.requests_per_minute
+    }
+
+
+def measure(function, repeat):
+    """
+    Runs a benchmark function the specified number of times
+    :param function: The function to run, called with no arguments
+    :param repeat: The number of runs
+    :return: A tuple of the fewest seconds taken by a run and the result of that run
+    """
+    best = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = function()
+        elapsed_time = time.perf_counter() - start_time
+        if best is None or elapsed_time < best[0]:
+            best = (elapsed_time, result)
+    return best
+
+
+def create_inputs(output_dir, args, extra_arguments=(), google_ids=(ROOT_ID,)):
+    """
+    Creates the command line arguments of a download of the synthetic tree
+    :param output_dir: The output directory of the download
+    :param args: The benchmark command line arguments
+    :param extra_arguments: Additional utility command line arguments
+    :param google_ids: The Google IDs of the downloaded folders or files, defaults to the root folder of the tree
+    :return: The utility command line arguments
+    """
+    from folder_inventory import parse_arguments as parse_utility_arguments
+    argv = sys.argv
+    sys.argv = [
+        'folder_download.py', *[argument for google_id in google_ids for argument in ['-i', google_id]],
+        '-o', output_dir, '-w', str(args.workers), '-r', str(args.requests_per_minute), *extra_arguments
+    ]
+    try:
+        return parse_utility_arguments()
+    finally:
+        sys.argv = argv
+
+
+def run_distributed_download(output_dir, queue_path, args):
+    """
+    Runs a distributed download of the synthetic tree with the coordinator in this process and each worker in a forked
+    process, the processes share the shard queue and the output directory as separate hosts would
+    :param output_dir: The output directory of the download
+    :param queue_path: The path of the shard queue
+    :param args: The benchmark command line arguments
+    """
+    import multiprocessing
+    import distributed_download
+    # Forked workers inherit the fake server URL and the stub credentials
+    context = multiprocessing.get_context('fork')
+    workers = [
+        context.Process(
+            target=distributed_download.main,
+            args=(create_inputs(output_dir, args, ['--role', 'worker', '--queue', queue_path]),)
+        )
+        for _ in range(args.hosts)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        distributed_download.main(create_inputs(output_dir, args, ['--role', 'coordinator', '--queue', queue_path]))
+    except BaseException:
+        # The workers wait for the coordinator to publish the tree, so they are stopped if it fails
+        for worker in workers:
+            worker.terminate()
+        raise
+    finally:
+        for worker in workers:
+            worker.join()
+    failed = [worker.exitcode for worker in workers if worker.exitcode != 0]
+    if failed:
+        raise RuntimeError("{} distributed download workers failed with exit codes {}".format(len(failed), failed))
+
+
+def read_statuses(output_dir):
+    """
+    Reads the file statuses from the CSV inventory report written to an output directory
+    :param output_dir: The output directory of a download
+    :return: A map of Google IDs to file statuses
+    """
+    with open(glob.glob(os.path.join(output_dir, '*.csv'))[0], newline='') as f:
+        rows = list(csv.reader(f))[1:]
+    return {row[7]: row[2] for row in rows}
+
+
+def benchmark_tree(server, shape, args):
+    """
+    Benchmarks the inventory, download and verification of a synthetic tree
+    :param server: The fake Google Drive server
+    :param shape: The name of the tree shape
+    :param args: The command line arguments
+    :return: A map of benchmark names to results
+    """
+    import file_download
+    import folder_download
+    from file_download import verify_md5
+    from folder_inventory import get_folder_contents
+    from google_drive_api import RequestScheduler, ThreadSafeAPI
+    logging.warning("Building the {} tree".format(shape))
+    drive = build_tree(shape, args.scale)
+    server.drive = drive
+    total_mib = drive.total_size / BYTES_IN_MIB
+    results = {}
+    # List the tree
+    api = ThreadSafeAPI(StubCredentials(), scheduler=RequestScheduler(args.requests_per_minute))
+    seconds, inventory = measure(lambda: get_folder_contents(api, ROOT_ID, args.workers), args.repeat)
+    if inventory is None or len(inventory) != drive.file_count:
+        raise RuntimeError("The {} inventory listed {} of {} files".format(
+            shape, len(inventory or []), drive.file_count
+        ))
+    results['{}/get_folder_contents'.format(shape)] = {
+        'seconds': seconds,
+        'files_per_second': drive.file_count / seconds
+    }
+    # Download the tree into a fresh working directory, as the progress journal is kept in the working directory
+    working_dir = os.getcwd()
+    temp_dir = tempfile.mkdtemp(prefix='benchmark-')
+    try:
+        os.chdir(temp_dir)
+
+        def download():
+            output_dir = tempfile.mkdtemp(dir=temp_dir)
+            folder_download.main(create_inputs(output_dir, args))
+            return output_dir
+
+        seconds, output_dir = measure(download, args.repeat)
+        results['{}/folder_download'.format(shape)] = {
+            'seconds': seconds,
+            'files_per_second': drive.file_count / seconds,
+            'mib_per_second': total_mib / seconds
+        }
+        # Verify the downloaded files
+        paths = [(os.path.join(output_dir, record.path), record.md5) for record in inventory]
+
+        def verify():
+            return sum(verify_md5(path, md5) for path, md5 in paths)
+
+        seconds, verified = measure(verify, args.repeat)
+        if verified != len(paths):
+            raise RuntimeError("{} of {} downloaded {} files were verified".format(verified, len(paths), shape))
+        results['{}/verify_md5'.format(shape)] = {
+            'seconds': seconds,
+            'files_per_second': len(paths) / seconds,
+            'mib_per_second': total_mib / seconds
+        }
+
+        # Download the tree again with a coordinator and several worker processes sharing a shard queue
+        def distributed_download():
+            output_dir = tempfile.mkdtemp(dir=temp_dir)
+            run_distributed_download(output_dir, os.path.join(tempfile.mkdtemp(dir=temp_dir), 'queue.db'), args)
+            return output_dir
+
+        seconds, output_dir = measure(distributed_download, args.repeat)
+        verified = list(read_statuses(output_dir).values()).count("Checksum Verified")
+        if verified != drive.file_count:
+            raise RuntimeError("The distributed download of the {} tree verified {} of {} files".format(
+                shape, verified, drive.file_count
+            ))
+        results['{}/distributed_download'.format(shape)] = {
+            'seconds': seconds,
+            'files_per_second': drive.file_count / seconds,
+            'mib_per_second': total_mib / seconds
+        }
+        # Download files by ID, looking up their metadata through the batch endpoint along with an ID that does not
+        # exist
+        files = inventory[:FILE_DOWNLOAD_FILES]
+
+        def download_files():
+            output_dir = tempfile.mkdtemp(dir=temp_dir)
+            file_download.main(create_inputs(
+                output_dir, args, google_ids=[record.google_id for record in files] + [MISSING_ID]
+            ))
+            return output_dir
+
+        seconds, output_dir = measure(download_files, args.repeat)
+        statuses = read_statuses(output_dir)
+        verified = [record.google_id for record in files if statuses.get(record.google_id) == "Checksum Verified"]
+        if len(verified) != len(files) or statuses.get(MISSING_ID) != "Metadata Lookup Error":
+            raise RuntimeError("The file download of the {} tree verified {} of {} files and reported {} as {}".format(
+                shape, len(verified), len(files), MISSING_ID, statuses.get(MISSING_ID)
+            ))
+        files_mib = sum(record.size for record in files) / BYTES_IN_MIB
+        results['{}/file_download'.format(shape)] = {
+            'seconds': seconds,
+            'files_per_second': len(files) / seconds,
+            'mib_per_second': files_mib / seconds
+        }
+    finally:
+        os.chdir(working_dir)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    return results
+
+
+def benchmark_report(args):
+    """
+    Benchmarks writing the inventory report of a large inventory
+    :param args: The command line arguments
+    :return: A map of benchmark names to results
+    """
+    from file_record import FileRecord, FileStatus
+    from folder_inventory import generate_inventory_report
+    count = int(REPORT_RECORDS * args.scale)
+    inventory = [
+        FileRecord(
+            "file{}.bin".format(i), "id{}".format(i), "0" * 32, i, 1609495200.0, "report/folder/file{}.bin".format(i),
+            status=FileStatus.CHECKSUM_VERIFIED
+        )
+        for i in range(count)
+    ]
+    temp_dir = tempfile.mkdtemp(prefix='benchmark-')
+    try:
+        seconds, _ = measure(lambda: generate_inventory_report(inventory, temp_dir), args.repeat)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    return {'report/generate_inventory_report': {'seconds': seconds, 'files_per_second': count / seconds}}
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints the results next to the baseline and returns the benchmarks that are slower than the baseline
+    :param results: The map of benchmark names to results
+    :param baseline: The baseline results file contents, or None if there is no baseline
+    :param tolerance: The fraction by which a benchmark may be slower than the baseline
+    :return: The names of the regressed benchmarks
+    """
+    regressions = []
+    baseline_results = baseline['results'] if baseline else {}
+    print("{:<40} {:>10} {:>12} {:>10} {:>10}".format("Benchmark", "Seconds", "Files/s", "MiB/s", "Baseline"))
+    for name, result in results.items():
+        baseline_seconds = baseline_results.get(name, {}).get('seconds')
+        change = ''
+        if baseline_seconds:
+            ratio = result['seconds'] / baseline_seconds
+            change = "{:+.0%}".format(ratio - 1)
+            if ratio > 1 + tolerance:
+                regressions.append(name)
+                change += " SLOWER"
+        print("{:<40} {:>10.3f} {:>12.1f} {:>10} {:>10}".format(
+            name, result['seconds'], result['files_per_second'],
+            "{:.1f}".format(result['mib_per_second']) if 'mib_per_second' in result else '-', change
+        ))
+    return regressions
+
+
+def main(args):
+    # Start the fake server before the utility modules are imported so that they use it as the API root URL
+    server = FakeDriveServer(
+        None,
+        latency=args.latency,
+        bandwidth=args.bandwidth * BYTES_IN_MIB if args.bandwidth else None,
+        requests_per_second=args.server_quota or None,
+        error_rate=args.error_rate
+    ).start()
+    os.environ['GOOGLE_DRIVE_ROOT_URL'] = server.root_url
+    import distributed_download
+    import file_download
+    import folder_download
+    import shard_queue
+    # Replace the service account credentials with credentials that do not need a key or network access
+    file_download.authenticate_service_accounts = lambda key_paths: [StubCredentials()]
+    folder_download.authenticate_service_accounts = lambda key_paths: [StubCredentials()]
+    distributed_download.authenticate_service_accounts = lambda key_paths: [StubCredentials()]
+    shard_queue.SHARD_FILES = DISTRIBUTED_SHARD_FILES
+    distributed_download.POLL_INTERVAL = DISTRIBUTED_POLL_INTERVAL
+    # Load the Google API client and the discovery document, which are loaded when the first connection is created, so
+    # that the one-off startup cost is not measured by the first benchmark
+    from googleapiclient import discovery
+    from google_drive_api import get_discovery_document
+    get_discovery_document()
+    results = {}
+    try:
+        for shape in args.trees:
+            results.update(benchmark_tree(server, shape, args))
+        results.update(benchmark_report(args))
+    finally:
+        server.stop()
+    # Compare the results with the baseline
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['config'] != get_config(args):
+            logging.warning("The baseline was recorded with different settings: {}".format(baseline['config']))
+    regressions = compare(results, baseline, args.tolerance)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'config': get_config(args), 'results': results}, f, indent=2)
+        logging.warning("Saved the baseline {}".format(args.baseline))
+    elif regressions:
+        logging.error("Slower than the baseline: {}".format(', '.join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    # Configure logger, the utility logs every file at the info level
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', datefmt='%Y-%m-%d %H:%M:%S',
+                        level=logging.WARNING)
+    sys.exit(main(parse_arguments()))
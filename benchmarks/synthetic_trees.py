@@ -0,0 +1,83 @@
+import random
+
+from fake_drive import FakeDrive
+
+BYTES_IN_KIB = 1024
+BYTES_IN_MIB = 1048576
+# Google ID of the root folder of every synthetic tree
+ROOT_ID = "root"
+
+
+def build_deep_tree(drive, scale):
+    """
+    A single chain of nested folders with a few small files in each folder, listing is bound by the round trips of the
+    folders that can only be listed one after another
+    :param drive: The fake drive to which the tree is added
+    :param scale: The multiplier of the tree size
+    """
+    folder_id = ROOT_ID
+    for depth in range(int(25 * scale)):
+        for i in range(4):
+            drive.add_file("{}-f{}".format(folder_id, i), "file{}.bin".format(i), folder_id, 64 * BYTES_IN_KIB)
+        sub_folder_id = "d{}".format(depth)
+        drive.add_folder(sub_folder_id, "level{}".format(depth), folder_id)
+        folder_id = sub_folder_id
+
+
+def build_wide_tree(drive, scale):
+    """
+    Many sibling folders with a few small files in each folder, listing is bound by how many folders are listed at once
+    :param drive: The fake drive to which the tree is added
+    :param scale: The multiplier of the tree size
+    """
+    for i in range(int(200 * scale)):
+        folder_id = "w{}".format(i)
+        drive.add_folder(folder_id, "folder{}".format(i), ROOT_ID)
+        for j in range(5):
+            drive.add_file("{}-f{}".format(folder_id, j), "file{}.bin".format(j), folder_id, 16 * BYTES_IN_KIB)
+
+
+def build_many_tiny_tree(drive, scale):
+    """
+    Thousands of tiny files in a few folders, downloading is bound by the per-file overhead
+    :param drive: The fake drive to which the tree is added
+    :param scale: The multiplier of the tree size
+    """
+    generator = random.Random(0)
+    for i in range(10):
+        folder_id = "t{}".format(i)
+        drive.add_folder(folder_id, "folder{}".format(i), ROOT_ID)
+        for j in range(int(300 * scale)):
+            size = generator.randint(0, 4 * BYTES_IN_KIB)
+            drive.add_file("{}-f{}".format(folder_id, j), "file{}.bin".format(j), folder_id, size)
+
+
+def build_few_huge_tree(drive, scale):
+    """
+    A handful of large files, downloading is bound by the bandwidth and the disk
+    :param drive: The fake drive to which the tree is added
+    :param scale: The multiplier of the tree size
+    """
+    for i in range(4):
+        drive.add_file("h{}".format(i), "huge{}.bin".format(i), ROOT_ID, int(96 * BYTES_IN_MIB * scale))
+
+
+TREES = {
+    'deep': build_deep_tree,
+    'wide': build_wide_tree,
+    'many-tiny': build_many_tiny_tree,
+    'few-huge': build_few_huge_tree
+}
+
+
+def build_tree(shape, scale=1.0):
+    """
+    Creates a fake drive holding a synthetic tree of the specified shape under a root folder
+    :param shape: The name of the tree shape
+    :param scale: The multiplier of the tree size
+    :return: The fake drive
+    """
+    drive = FakeDrive()
+    drive.add_folder(ROOT_ID, shape)
+    TREES[shape](drive, scale)
+    return drive
@@ -0,0 +1,90 @@
+import atexit
+import concurrent.futures
+import hashlib
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+# Size of the buffer reused for every read while calculating a checksum
+BUFFER_SIZE = 8 * 1048576
+# Start method of the verification processes, a forked process would inherit the locks held by the download and lease
+# threads of the run, so the processes are started by a fork server where it is available and by a new interpreter
+# otherwise
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+# The verification process pool of this process, started by the first verification and shared by the rest of the run
+verification_pool = None
+verification_lock = threading.Lock()
+
+
+def calculate_md5(file_path, buffer_size=BUFFER_SIZE):
+    """
+    Calculates the MD5 checksum of a file by reading it into a single reused buffer
+    :param file_path: The path of the file
+    :param buffer_size: The size of the read buffer
+    :return: The hexadecimal MD5 checksum string
+    """
+    md5hash = hashlib.md5()
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    with open(file_path, 'rb', buffering=0) as file:
+        size = file.readinto(buffer)
+        while size:
+            md5hash.update(view[:size])
+            size = file.readinto(buffer)
+    return md5hash.hexdigest()
+
+
+def calculate_md5_task(file_path):
+    """
+    Calculates the MD5 checksum of a file in a verification process, errors are returned instead of raised so that one
+    unreadable file does not stop the other files from being verified
+    :param file_path: The path of the file
+    :return: A tuple of the hexadecimal MD5 checksum string, or None on error, the error message and the number of
+    seconds the calculation took
+    """
+    start_time = time.monotonic()
+    try:
+        return calculate_md5(file_path), None, time.monotonic() - start_time
+    except Exception as ex:
+        return None, str(ex), time.monotonic() - start_time
+
+
+def get_verification_pool():
+    """
+    Returns the pool of verification processes, which is started once per process and reused by every batch of files,
+    with one process per processor
+    :return: The process pool executor
+    """
+    global verification_pool
+    with verification_lock:
+        if verification_pool is None:
+            verification_pool = concurrent.futures.ProcessPoolExecutor(
+                mp_context=multiprocessing.get_context(START_METHOD)
+            )
+            # Stop the processes before the interpreter shuts down the modules they are managed with
+            atexit.register(verification_pool.shutdown)
+        return verification_pool
+
+
+def calculate_checksums(file_paths):
+    """
+    Calculates the MD5 checksums of many files concurrently using the pool of verification processes and logs the
+    throughput
+    :param file_paths: The paths of the files
+    :return: A list of tuples of the checksum, or None on error, the error message and the calculation time in seconds
+    in the order of the file paths
+    """
+    if not file_paths:
+        return []
+    total_size = sum(os.path.getsize(file_path) for file_path in file_paths if os.path.exists(file_path))
+    logging.info("Verifying {} files ({:.1f} MB)".format(len(file_paths), total_size / 1000000))
+    start_time = time.monotonic()
+    results = list(get_verification_pool().map(calculate_md5_task, file_paths))
+    elapsed_time = max(time.monotonic() - start_time, 0.001)
+    logging.info("Verified {} files in {:.1f} seconds ({:.1f} MB/s)".format(
+        len(file_paths), elapsed_time, total_size / 1000000 / elapsed_time
+    ))
+    return results
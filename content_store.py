@@ -0,0 +1,156 @@
+import logging
+import os
+import shutil
+import threading
+
+# Methods by which a duplicate file is created from a local copy of the same content
+HARDLINK_METHOD = 'hardlink'
+REFLINK_METHOD = 'reflink'
+COPY_METHOD = 'copy'
+DEDUP_METHODS = [HARDLINK_METHOD, REFLINK_METHOD, COPY_METHOD]
+# Linux ioctl request that makes a file share the data blocks of another file on copy-on-write file systems
+FICLONE = 0x40049409
+# Suffix of the file a duplicate is created at before it is moved to its final path
+DEDUP_SUFFIX = ".dedup"
+
+
+class ContentStore:
+
+    def __init__(self, method=HARDLINK_METHOD):
+        """
+        Initialize a thread-safe map of file contents, identified by their MD5 checksum and size, to the local paths
+        holding them, so that content shared by several Google Drive files is only downloaded once
+        :param method: The method used to create duplicates, hardlink and reflink fall back to a copy when the file
+        system does not support them
+        """
+        self.method = method
+        self.condition = threading.Condition()
+        # Map of content keys to the local path holding the content and whether the path was verified during this run
+        self.sources = {}
+        # Keys of the contents that are being downloaded by a worker
+        self.pending = set()
+
+    @staticmethod
+    def get_key(metadata):
+        """
+        Returns the content key of a file
+        :param metadata: Target file record
+        :return: The tuple of the MD5 checksum and size, or None if the file has no checksum
+        """
+        if metadata.md5 is None or metadata.size is None:
+            return None
+        return metadata.md5, metadata.size
+
+    def add_existing(self, md5, size, path):
+        """
+        Adds a file downloaded by a previous run as a source, the file is verified when it is first duplicated
+        :param md5: The MD5 checksum the file had when it was downloaded
+        :param size: The size of the file
+        :param path: The local path of the file
+        """
+        with self.condition:
+            self.sources.setdefault((md5, size), (path, False))
+
+    def add(self, metadata, path):
+        """
+        Adds a file that was verified during this run as a source
+        :param metadata: Target file record
+        :param path: The local path of the file
+        """
+        key = self.get_key(metadata)
+        if key is None:
+            return
+        with self.condition:
+            self.sources[key] = (path, True)
+
+    def acquire(self, metadata):
+        """
+        Returns a local source of the contents of a file, waiting while another worker downloads the same contents, if
+        there is no source the caller is expected to download the file and then call release
+        :param metadata: Target file record
+        :return: A tuple of the source path and whether it was verified during this run, or None if there is no source
+        """
+        key = self.get_key(metadata)
+        if key is None:
+            return None
+        with self.condition:
+            while key in self.pending:
+                self.condition.wait()
+            source = self.sources.get(key)
+            if source is None:
+                self.pending.add(key)
+            return source
+
+    def release(self, metadata, path=None):
+        """
+        Records the outcome of a download started after acquire returned no source and wakes the waiting workers
+        :param metadata: Target file record
+        :param path: The local path of the file if it was downloaded and verified, otherwise None
+        """
+        key = self.get_key(metadata)
+        if key is None:
+            return
+        with self.condition:
+            self.pending.discard(key)
+            if path is not None:
+                self.sources[key] = (path, True)
+            self.condition.notify_all()
+
+    def discard(self, metadata, path):
+        """
+        Removes a source whose contents turned out not to match its checksum
+        :param metadata: Target file record
+        :param path: The local path of the source
+        """
+        key = self.get_key(metadata)
+        with self.condition:
+            if self.sources.get(key, (None,))[0] == path:
+                del self.sources[key]
+
+    def duplicate(self, source, destination):
+        """
+        Creates a file at the destination path with the contents of the source file
+        :param source: The path of the source file
+        :param destination: The path of the duplicate
+        :return: The method used to create the duplicate
+        """
+        temp_path = destination + DEDUP_SUFFIX
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        method = self.method
+        try:
+            if method == HARDLINK_METHOD:
+                os.link(source, temp_path)
+            elif method == REFLINK_METHOD:
+                reflink(source, temp_path)
+            else:
+                shutil.copyfile(source, temp_path)
+        except OSError as ex:
+            if method == COPY_METHOD:
+                raise
+            logging.debug("Unable to {} {}, copying instead: {}".format(method, os.path.basename(source), ex))
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            method = COPY_METHOD
+            shutil.copyfile(source, temp_path)
+        os.replace(temp_path, destination)
+        return method
+
+
+def reflink(source, destination):
+    """
+    Creates a copy-on-write clone of a file, which is supported by Btrfs, XFS and other Linux file systems
+    :param source: The path of the source file
+    :param destination: The path of the clone
+    """
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError("Reflinks are not supported on this platform")
+    with open(source, 'rb') as source_file, open(destination, 'wb') as destination_file:
+        try:
+            fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+        except OSError:
+            destination_file.close()
+            os.remove(destination)
+            raise
@@ -0,0 +1,128 @@
+from folder_download import *
+from shard_queue import *
+
+# Number of seconds between checks of the shard queue while the coordinator waits for the workers or a worker waits
+# for shards to be published
+POLL_INTERVAL = 5
+
+
+def create_api(inputs):
+    """
+    Create a Google Drive API connection that spreads the requests over the service accounts
+    :param inputs: User inputs object
+    :return: The pooled Google Drive API connection
+    """
+    credentials = authenticate_service_accounts(inputs.service_account)
+    return PooledAPI(
+        credentials,
+        inputs.requests_per_minute,
+        chunk_size=inputs.chunk_size * BYTES_IN_MIB,
+        connections=inputs.connections
+    )
+
+
+def coordinate(inputs):
+    """
+    Lists the target folders once, publishing their files to the shard queue as they are found, then waits for the
+    workers to complete every shard and writes the merged inventory report of the transfer
+    :param inputs: User inputs object
+    """
+    queue = ShardQueue(inputs.queue)
+    api = create_api(inputs)
+    for folder_id in inputs.google_id:
+        # A restarted coordinator does not list the folders that were completely published before it was interrupted
+        if queue.is_listed(folder_id):
+            logging.info("Folder {} has already been published".format(folder_id))
+            continue
+        root_folder = get_root_folder(api, folder_id)
+        if root_folder is None:
+            # Publish the folder without files so that the workers do not wait for it
+            queue.publish(folder_id, [])
+            continue
+        logging.info("Publishing the files of folder {}".format(folder_id))
+        published = queue.publish(folder_id, iterate_folder_contents(api, root_folder, inputs.workers))
+        logging.info("Published {} files of folder {}".format(published, folder_id))
+    # Wait for the workers to complete the shards
+    while not queue.is_finished(inputs.google_id):
+        progress = queue.get_progress()
+        logging.info("Shards pending: {}, leased: {}, done: {}".format(
+            progress.get(PENDING, 0), progress.get(LEASED, 0), progress.get(DONE, 0)
+        ))
+        time.sleep(POLL_INTERVAL)
+    # Write the final status of every file reported by the workers to a single inventory report
+    report = InventoryReport(inputs.output_dir, inputs.report_format)
+    report.extend(queue.iterate_results(inputs.google_id))
+    report_path = report.close()
+    queue.close()
+    # Write the performance metrics of the inventory next to the report
+    api.instrumentation.export(report_path, inputs.metrics)
+    # Print the API request statistics of the run
+    api.log_summary()
+    # Print that the transfer has completed
+    logging.info("Transfer Completed")
+
+
+def work(inputs):
+    """
+    Claims shards from the shard queue and downloads and verifies their files until every target folder has been
+    published and every shard is done, the final status of each file is reported back to the queue
+    :param inputs: User inputs object
+    """
+    queue = ShardQueue(inputs.queue)
+    api = create_api(inputs)
+    worker = get_worker_name()
+    # Create the content store if files with the same contents are only downloaded once, only the files downloaded
+    # by this worker are duplicated
+    store = ContentStore(inputs.dedup) if inputs.dedup else None
+    while True:
+        lease = queue.claim(worker)
+        if lease is None:
+            if queue.is_finished(inputs.google_id):
+                break
+            # Wait for the coordinator to publish more files or for an expired lease to be reclaimable
+            time.sleep(POLL_INTERVAL)
+            continue
+        # The files completed by a worker whose lease expired keep the status it reported
+        files = [metadata for metadata in lease.files if metadata.status == FileStatus.NOT_APPLICABLE]
+        logging.info("Worker {} claimed shard {} with {} of {} files remaining".format(
+            worker, lease.shard_id, len(files), len(lease.files)
+        ))
+        # The lease takes the place of the progress journal and the files are reported to the coordinator through
+        # the queue instead of a local inventory report, no other file is started once the lease is lost
+        try:
+            download_inventory(files, [], inputs, api, lease, Metrics(files), store=store, cancelled=lease.lost)
+        except BaseException:
+            # Leave the shard to be claimed again once the lease expires
+            lease.abandon()
+            raise
+        if not lease.complete():
+            logging.warning("Worker {} lost the lease of shard {}, its remaining files are left to the worker that "
+                            "claimed it".format(worker, lease.shard_id))
+    queue.close()
+    # Write the performance metrics of the worker next to the shard queue, the extension is replaced by the export
+    worker_path = os.path.join(
+        os.path.dirname(os.path.abspath(inputs.queue)), "worker-{}.json".format(worker.replace(':', '-'))
+    )
+    api.instrumentation.export(worker_path, inputs.metrics)
+    # Print the API request statistics of the worker
+    api.log_summary()
+    logging.info("Worker {} completed".format(worker))
+
+
+def main(inputs):
+    if inputs.role == COORDINATOR_ROLE:
+        coordinate(inputs)
+    else:
+        work(inputs)
+
+
+if __name__ == '__main__':
+    # Configure logger
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', datefmt='%Y-%m-%d %H:%M:%S', level=logging.INFO)
+    # Parse and verify command line arguments
+    args = parse_arguments()
+    if verify_args(args):
+        if not args.role:
+            logging.error("The role of the process must be specified with the '--role' flag")
+        else:
+            main(args)
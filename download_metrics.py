@@ -1,45 +1,143 @@
+import collections
 from google_drive_api import *
 
-BYTES_IN_GB = 1073741824
+# Number of most recently completed downloads used to measure the throughput
+WINDOW_SIZE = 200
+# Minimum number of completed downloads before an estimate is made
+MIN_DATA_POINTS = 3
 
 class Metrics:
 
-    def __init__(self, file_data):
+    def __init__(self, file_data, window_size=WINDOW_SIZE):
         """
-        Initialize a metrics object used to estimate the remaining download time based on previous download speeds
-        :param file_data: The metadata array of the files to be downloaded
+        Initialize a metrics object used to estimate the remaining download time from the throughput of the most
+        recent downloads, the time of each download is modeled as a fixed per-file overhead plus its size divided by
+        the bandwidth so that estimates stay accurate when small and large files are mixed
+        :param file_data: The record array of the files to be downloaded
+        :param window_size: The number of most recently completed downloads used to measure the throughput
         """
-        self.data_points = 0
         self.start_time = None
         self.total_size = 0
+        self.total_files = 0
         for file in file_data:
-            file_size = int(file[GOOGLE_FILE_SIZE]) / BYTES_IN_GB
-            self.total_size += file_size
+            self.total_size += file.size or 0
+            self.total_files += 1
         self.remaining_size = self.total_size
+        self.remaining_files = self.total_files
+        # Completion time, size and duration of the most recent downloads
+        self.window = collections.deque(maxlen=window_size)
+        # Lock guarding the sizes, as files can be added while downloads are being completed
+        self.lock = threading.Lock()
+
+    def add_file(self, file_size):
+        """
+        Add a file found after the metrics object was initialized to the data to be downloaded
+        :param file_size: The size of the file in bytes
+        """
+        with self.lock:
+            self.total_size += file_size
+            self.remaining_size += file_size
+            self.total_files += 1
+            self.remaining_files += 1
+
+    def remove_file(self, file_size):
+        """
+        Remove a file that does not need to be downloaded from the data to be downloaded
+        :param file_size: The size of the file in bytes
+        """
+        with self.lock:
+            self.total_size -= file_size
+            self.remaining_size -= file_size
+            self.total_files -= 1
+            self.remaining_files -= 1
 
     def log_start(self):
         """
         Store the current time as the start time of the download
         """
-        self.start_time = datetime.datetime.now()
+        self.start_time = time.monotonic()
 
-    def update_estimate(self, file_size):
+    def update_estimate(self, file_size, duration):
         """
         Update the and return a remaining time estimate after successfully downloading a file
-        :param file_size: The size of the file downloaded
+        :param file_size: The size of the file downloaded in bytes
+        :param duration: The number of seconds the download took
         :return: An estimate of the remaining download time
         """
-        # Update remaining size of data to be downloaded
-        file_size = int(file_size) / BYTES_IN_GB
-        self.remaining_size -= file_size
-        # If there have been less than 3 downloads, return that there is not enough data yet for an estimate
-        if self.data_points < 3:
-            self.data_points += 1
-            return "Not yet enough data for estimate"
-        # Generate an estimate using running time, the amount of data downloaded, and the amount of data remaining
+        with self.lock:
+            # Update remaining size of data to be downloaded
+            self.remaining_size -= file_size
+            self.remaining_files -= 1
+            self.window.append((time.monotonic(), file_size, duration))
+            # If there have been less than 3 downloads, return that there is not enough data yet for an estimate
+            if len(self.window) < MIN_DATA_POINTS:
+                return "Not yet enough data for estimate"
+            # Estimate the time the remaining files would take one at a time, then divide it by the number of
+            # downloads that have been running at once
+            overhead, seconds_per_byte = self.fit_transfer_model()
+            work = self.remaining_files * overhead + self.remaining_size * seconds_per_byte
+            return datetime.timedelta(seconds=round(work / self.get_concurrency()))
+
+    def fit_transfer_model(self):
+        """
+        Fits the download durations in the window to a per-file overhead plus a per-byte transfer time with least
+        squares, the caller must hold the lock
+        :return: A tuple of the overhead in seconds and the transfer time in seconds per byte
+        """
+        count = len(self.window)
+        mean_size = sum(size for _, size, _ in self.window) / count
+        mean_duration = sum(duration for _, _, duration in self.window) / count
+        variance = sum((size - mean_size) ** 2 for _, size, _ in self.window)
+        if variance > 0:
+            covariance = sum((size - mean_size) * (duration - mean_duration) for _, size, duration in self.window)
+            seconds_per_byte = max(covariance / variance, 0)
+            overhead = max(mean_duration - seconds_per_byte * mean_size, 0)
+        # If every file had the same size the two terms cannot be separated and the time is attributed to the bytes
+        elif mean_size > 0:
+            seconds_per_byte = mean_duration / mean_size
+            overhead = 0
         else:
-            elapsed_time = datetime.datetime.now() - self.start_time
-            downloaded_size = self.total_size - self.remaining_size
-            estimate = elapsed_time * self.remaining_size / downloaded_size
-            return estimate
+            seconds_per_byte = 0
+            overhead = mean_duration
+        return overhead, seconds_per_byte
 
+    def get_window_span(self):
+        """
+        Returns the number of seconds from the start of the earliest download in the window until now, the caller must
+        hold the lock
+        :return: The span of the window in seconds
+        """
+        now = time.monotonic()
+        return max(now - min(end - duration for end, _, duration in self.window), 0.001)
+
+    def get_concurrency(self):
+        """
+        Returns the average number of downloads that were running at once during the window, the caller must hold the
+        lock
+        :return: The average number of concurrent downloads
+        """
+        return max(sum(duration for _, _, duration in self.window) / self.get_window_span(), 0.001)
+
+    def get_throughput(self):
+        """
+        Returns the download throughput over the window
+        :return: A tuple of the bytes downloaded per second and the files downloaded per second
+        """
+        with self.lock:
+            if not self.window:
+                return 0.0, 0.0
+            span = self.get_window_span()
+            return sum(size for _, size, _ in self.window) / span, len(self.window) / span
+
+    def get_large_file_size(self):
+        """
+        Returns the file size above which a download spends more time transferring bytes than on its per-file overhead
+        :return: The size in bytes, or None if there is not enough data yet
+        """
+        with self.lock:
+            if len(self.window) < MIN_DATA_POINTS:
+                return None
+            overhead, seconds_per_byte = self.fit_transfer_model()
+            if seconds_per_byte <= 0:
+                return None
+            return overhead / seconds_per_byte
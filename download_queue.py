@@ -0,0 +1,107 @@
+import bisect
+import itertools
+import threading
+
+from google_drive_api import BYTES_IN_MIB
+from instrumentation import DOWNLOAD_QUEUE_DEPTH
+
+# File size above which a file is considered large until the download metrics can measure the per-file overhead
+DEFAULT_LARGE_FILE_SIZE = 64 * BYTES_IN_MIB
+
+
+class DownloadQueue:
+
+    def __init__(self, capacity, workers, metrics=None, instrumentation=None):
+        """
+        Initialize a thread-safe queue of files waiting to be downloaded that hands out the files by size, workers take
+        the largest waiting file so that large files start early, except that one worker keeps taking the smallest
+        files while every other worker is busy with a large file so that small files fill the gaps
+        :param capacity: The maximum number of files waiting in the queue
+        :param workers: The number of workers taking files from the queue
+        :param metrics: If provided, the download metrics used to decide which files are large
+        :param instrumentation: If provided, the run instrumentation in which the queue depth is recorded
+        """
+        self.capacity = capacity
+        self.workers = workers
+        self.metrics = metrics
+        self.instrumentation = instrumentation
+        # Waiting files as tuples of size, insertion order and record, sorted by size
+        self.files = []
+        self.sequence = itertools.count()
+        self.large_downloads = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def is_large(self, size):
+        """
+        Checks if a file takes longer to transfer than its per-file overhead
+        :param size: The size of the file in bytes
+        :return: Boolean result of the check
+        """
+        large_file_size = self.metrics.get_large_file_size() if self.metrics else None
+        if large_file_size is None:
+            large_file_size = DEFAULT_LARGE_FILE_SIZE
+        return size >= large_file_size
+
+    def put(self, record):
+        """
+        Adds a file to the queue, waiting while the queue is full
+        :param record: The record of the file
+        :return: False if the queue was closed and the file was not added, otherwise True
+        """
+        with self.condition:
+            while len(self.files) >= self.capacity and not self.closed:
+                self.condition.wait()
+            if self.closed:
+                return False
+            bisect.insort(self.files, (record.size or 0, next(self.sequence), record))
+            self.condition.notify_all()
+            return True
+
+    def get(self):
+        """
+        Takes the next file to download from the queue, waiting while the queue is empty
+        :return: A tuple of the record of the file and whether it is large, or None once the queue is closed and empty
+        """
+        with self.condition:
+            while not self.files and not self.closed:
+                self.condition.wait()
+            if not self.files:
+                return None
+            if self.workers > 1 and self.large_downloads >= self.workers - 1:
+                size, _, record = self.files.pop(0)
+            else:
+                size, _, record = self.files.pop()
+            large = self.is_large(size)
+            if large:
+                self.large_downloads += 1
+            if self.instrumentation:
+                self.instrumentation.set_gauge(DOWNLOAD_QUEUE_DEPTH, len(self.files))
+            self.condition.notify_all()
+            return record, large
+
+    def task_done(self, large):
+        """
+        Records that a worker finished downloading a file it took from the queue
+        :param large: Whether the file was large
+        """
+        with self.condition:
+            if large:
+                self.large_downloads -= 1
+
+    def close(self):
+        """
+        Closes the queue once every file has been added, workers finish the waiting files before stopping
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def abort(self):
+        """
+        Closes the queue and discards the waiting files so that workers and producers stop as soon as possible
+        """
+        with self.condition:
+            self.closed = True
+            self.files = []
+            self.condition.notify_all()
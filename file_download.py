@@ -1,74 +1,220 @@
-import hashlib
 import os
-from os.path import exists
+from checksum_verification import calculate_md5
+from content_store import *
 from folder_inventory import *
-from google_authentication import authenticate_service_account
+from google_authentication import authenticate_service_accounts
 from google_drive_api import *
 
-# Block size used for file reading during MD5 Checksum verification
-BLOCK_SIZE = 65536
+# Results of comparing an existing local file with the Google Drive metadata of the file
+LOCAL_FILE_MISSING = 'missing'
+LOCAL_SIZE_MISMATCHED = 'size mismatched'
+LOCAL_FILE_MATCHED = 'matched'
+LOCAL_FILE_AMBIGUOUS = 'ambiguous'
+# Maximum difference in seconds between the local and the Google Drive modified times of a matching file
+MODIFIED_TIME_TOLERANCE = 0.001
 
 
-def download_file(metadata, inputs, api):
+def get_output_path(metadata, inputs):
+    """
+    Generates the output path of a file
+    :param metadata: Target file record
+    :param inputs: User inputs object
+    :return: The path to which the file is downloaded
+    """
+    if metadata.path:
+        return os.path.join(inputs.output_dir, metadata.path)
+    return os.path.join(inputs.output_dir, metadata.name)
+
+
+def download_file(metadata, inputs, api, overwrite=False, store=None):
     """
     Uses the provided Google API connection to download the specified file
-    :param metadata: Target file metadata
+    :param metadata: Target file record
     :param inputs: User inputs object
     :param api: Google Drive API connection
+    :param overwrite: If true an existing file is downloaded again regardless of the file conflict resolution mode
+    :param store: If provided, the content store from which a local copy of the same contents is duplicated instead of
+    downloading the file, and in which the verified file is recorded
+    :return: Boolean result of the download, true if the contents of the file were downloaded from Google Drive and
+    false if the file was kept, verified or duplicated locally, or if the download failed
     """
     # Generate file output path
-    if FILE_PATH in metadata:
-        path = os.path.join(inputs.output_dir, metadata[FILE_PATH])
-    else:
-        path = os.path.join(inputs.output_dir, metadata[GOOGLE_FILE_NAME])
+    path = get_output_path(metadata, inputs)
     # Create output folder hierarchy if necessary
     folder_name = os.path.dirname(path)
-    if folder_name and not os.path.exists(folder_name):
-        os.makedirs(folder_name)
+    if folder_name:
+        os.makedirs(folder_name, exist_ok=True)
     # Get file name
     file_name = os.path.basename(path)
-    # If the file does not already exist or the utility is in overwrite mode
-    if not exists(path) or inputs.mode == OVERWRITE_MODE:
+    # Compare the existing file with the Google Drive metadata before deciding if it has to be read or downloaded
+    comparison = LOCAL_FILE_MISSING
+    if inputs.mode != OVERWRITE_MODE and not overwrite:
+        comparison = compare_local_file(path, metadata)
+        if comparison == LOCAL_SIZE_MISMATCHED:
+            logging.warning("{} size does not match the Google Drive file size".format(file_name))
+    # If the file does not already exist or has the wrong size, the utility is in overwrite mode or overwriting is
+    # requested
+    if comparison in [LOCAL_FILE_MISSING, LOCAL_SIZE_MISMATCHED]:
+        # Create the file from a local copy of the same contents if there is one
+        if store is not None and duplicate_file(path, metadata, store, api.instrumentation):
+            return False
         # Attempt to download the file and verify the MD5 checksum
+        downloaded = False
         try:
             logging.info("Downloading File: {}".format(file_name))
-            api.download_file(path, metadata[GOOGLE_FILE_ID])
-            verify_file(path, metadata)
+            start_time = time.monotonic()
+            calculated_md5 = api.download_file(
+                path, metadata.google_id, metadata.size, metadata.md5, metadata.modified_time
+            )
+            api.instrumentation.observe(FILE_DOWNLOAD_SECONDS, time.monotonic() - start_time)
+            api.instrumentation.increment(DOWNLOADED_FILES)
+            downloaded = True
+            verify_file(path, metadata, calculated_md5, api.instrumentation)
         # If an exception occurs during the file download, print an error message and update the file status
         except Exception as ex:
             logging.error("An error occurred while downloading file: {}".format(file_name))
             logging.error(ex)
-            metadata[FILE_STATUS] = "Download Error"
+            metadata.status = FileStatus.DOWNLOAD_ERROR
+        finally:
+            # Let the workers waiting for the same contents duplicate the file or download it themselves
+            if store is not None:
+                store.release(metadata, path if metadata.status == FileStatus.CHECKSUM_VERIFIED else None)
+        return downloaded
+    # Else if the file has the size and the modified time it was given when its checksum was last verified
+    elif comparison == LOCAL_FILE_MATCHED:
+        logging.info("{} size and modified time match".format(file_name))
+        metadata.status = FileStatus.SIZE_AND_TIME_MATCHED
+        api.instrumentation.increment(MATCHED_FILES)
     # Else if the utility is in verify mode
     elif inputs.mode == VERIFY_MODE:
         # Verify the MD5 checksum of the target file that already exists in the output directory
-        verify_file(path, metadata)
+        verify_file(path, metadata, instrumentation=api.instrumentation)
     # Else update the status to record that the file already existed and the MD5 checksum verification was skipped
     else:
-        metadata[FILE_STATUS] = "File Verification Skipped"
+        metadata.status = FileStatus.VERIFICATION_SKIPPED
+    # Record the existing file as a source of its contents if it is known to be intact
+    if store is not None and metadata.status in [FileStatus.CHECKSUM_VERIFIED, FileStatus.SIZE_AND_TIME_MATCHED]:
+        store.add(metadata, path)
+    return False
+
+
+def duplicate_file(path, metadata, store, instrumentation=None):
+    """
+    Creates a file from a local copy of the same contents instead of downloading it, a copy left by a previous run is
+    verified before it is trusted
+    :param path: The path of the file
+    :param metadata: Target file record
+    :param store: The content store of the run
+    :param instrumentation: If provided, the run instrumentation in which the duplicated files are counted
+    :return: Boolean result of the duplication, if false the caller must download the file and release it in the store
+    """
+    file_name = os.path.basename(path)
+    source = store.acquire(metadata)
+    while source is not None:
+        source_path, verified = source
+        try:
+            # The source may have been deleted or modified since it was recorded
+            if compare_local_file(source_path, metadata) in [LOCAL_FILE_MISSING, LOCAL_SIZE_MISMATCHED]:
+                raise OSError("The source {} is missing or has the wrong size".format(source_path))
+            logging.info("Duplicating File: {} from {}".format(file_name, source_path))
+            store.duplicate(source_path, path)
+            if verified:
+                metadata.status = FileStatus.DUPLICATE_COPIED
+                set_modified_time(path, metadata)
+            else:
+                verify_file(path, metadata, instrumentation=instrumentation)
+            if metadata.status in [FileStatus.DUPLICATE_COPIED, FileStatus.CHECKSUM_VERIFIED]:
+                if instrumentation:
+                    instrumentation.increment(DEDUPLICATED_FILES)
+                    instrumentation.increment(DEDUPLICATED_BYTES, metadata.size)
+                store.add(metadata, path)
+                return True
+        except OSError as ex:
+            logging.warning("Unable to duplicate file: {}".format(file_name))
+            logging.warning(ex)
+        # Try the next source, or download the file if there is none
+        store.discard(metadata, source_path)
+        source = store.acquire(metadata)
+    return False
 
 
-def verify_file(path, metadata):
+def compare_local_file(path, metadata, verified_mtime=None):
+    """
+    Compares the size and the modified time of a local file with the Google Drive metadata of the file without reading
+    it, a verified file is given the Google Drive modified time so a matching modified time means the file has not
+    changed since its checksum was verified
+    :param path: The path of the local file
+    :param metadata: Target file record
+    :param verified_mtime: If provided, the modified time the local file had when its checksum was last verified, which
+    also matches the file, used for hard links that cannot be given their own Google Drive modified time
+    :return: LOCAL_FILE_MISSING, LOCAL_SIZE_MISMATCHED, LOCAL_FILE_MATCHED or LOCAL_FILE_AMBIGUOUS if the file has to
+    be read to be verified
     """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return LOCAL_FILE_MISSING
+    if metadata.size is None:
+        return LOCAL_FILE_AMBIGUOUS
+    if stat.st_size != metadata.size:
+        return LOCAL_SIZE_MISMATCHED
+    for matching_time in [metadata.modified_time, verified_mtime]:
+        if matching_time is not None and abs(stat.st_mtime - matching_time) < MODIFIED_TIME_TOLERANCE:
+            return LOCAL_FILE_MATCHED
+    return LOCAL_FILE_AMBIGUOUS
 
-    :param path:
-    :param metadata:
-    :return:
+
+def set_modified_time(path, metadata):
+    """
+    Sets the modified time of a verified local file to the Google Drive modified time of the file, so that later runs
+    can match the file without reading it, a hard link is left unchanged as its modified time is shared with the other
+    links to the same data, which must keep matching their own metadata
+    :param path: The path of the local file
+    :param metadata: Target file record
+    """
+    if metadata.modified_time is None:
+        return
+    try:
+        if os.stat(path).st_nlink > 1:
+            return
+        os.utime(path, (time.time(), metadata.modified_time))
+    except OSError as ex:
+        logging.warning("Unable to set the modified time of file: {}".format(os.path.basename(path)))
+        logging.warning(ex)
+
+
+def verify_file(path, metadata, calculated_md5=None, instrumentation=None):
+    """
+    Verifies the MD5 checksum of a file and updates the file status
+    :param path: The path of the file to verify
+    :param metadata: Target file record
+    :param calculated_md5: The MD5 checksum calculated while downloading the file, if omitted the file is read from disk
+    :param instrumentation: If provided, the run instrumentation in which the time spent reading the file is recorded
     """
     try:
         file_name = os.path.basename(path)
         logging.info("Verifying File: {}".format(file_name))
-        if verify_md5(path, metadata[GOOGLE_FILE_MD5]):
+        if calculated_md5 is not None:
+            verified = metadata.md5 == calculated_md5
+        else:
+            start_time = time.monotonic()
+            verified = verify_md5(path, metadata.md5)
+            if instrumentation:
+                instrumentation.observe(FILE_VERIFY_SECONDS, time.monotonic() - start_time)
+                instrumentation.increment(VERIFIED_FILES)
+                instrumentation.increment(VERIFIED_BYTES, os.path.getsize(path))
+        if verified:
             logging.info("{} MD5 Checksum verified".format(file_name))
-            metadata[FILE_STATUS] = "Checksum Verified"
+            metadata.status = FileStatus.CHECKSUM_VERIFIED
+            set_modified_time(path, metadata)
         else:
             logging.warning("{} MD5 Checksum Mismatch".format(file_name))
-            metadata[FILE_STATUS] = "Checksum Mismatched"
+            metadata.status = FileStatus.CHECKSUM_MISMATCHED
     # If an exception occurs during download verification, print an error message and update the file status
     except Exception as ex:
         logging.error("An error occurred while verifying checksum of file: {}".format(file_name))
         logging.error(ex)
-        metadata[FILE_STATUS] = "Checksum Verification Error"
+        metadata.status = FileStatus.VERIFICATION_ERROR
 
 
 def verify_md5(file_path, md5):
@@ -79,32 +225,43 @@ def verify_md5(file_path, md5):
     :return: The Boolean result of the verification
     """
     # Generate an MD5 checksum and then verify that it matches the provided checksum
-    md5hash = hashlib.md5()
-    with open(file_path, 'rb') as file:
-        data = file.read(BLOCK_SIZE)
-        while data:
-            md5hash.update(data)
-            data = file.read(BLOCK_SIZE)
-    calculated_md5 = md5hash.hexdigest()
-    return md5 == calculated_md5
+    return md5 == calculate_md5(file_path)
 
 
 def main(inputs):
-    # Create service account credentials
-    credentials = authenticate_service_account()
-    # Create Google Drive API connection using service account credentials
-    api = API(credentials)
-    # Create an array to store the downloaded files metadata
+    # Create the credentials of each service account
+    credentials = authenticate_service_accounts(inputs.service_account)
+    # Create a Google Drive API connection that spreads the requests over the service accounts
+    api = PooledAPI(
+        credentials,
+        inputs.requests_per_minute,
+        chunk_size=inputs.chunk_size * BYTES_IN_MIB,
+        connections=inputs.connections
+    )
+    # Create the content store if files with the same contents are only downloaded once
+    store = ContentStore(inputs.dedup) if inputs.dedup else None
+    # Create an array to store the downloaded file records
     downloaded_files = []
     # Loop through each provided Google ID
     logging.info("Beginning transfer")
+    files, errors = api.get_files_by_ids(inputs.google_id)
     for file_id in inputs.google_id:
-        metadata = api.get_file_by_id(file_id)
-        download_file(metadata, inputs, api)
-        # Append the file metadata to the download files array
+        # Report any file whose metadata could not be retrieved as failed, its name and size are unknown
+        if file_id in errors:
+            logging.error("Unable to access file with ID: {}".format(file_id))
+            logging.error(errors[file_id])
+            downloaded_files.append(FileRecord(None, file_id, status=FileStatus.METADATA_ERROR))
+            continue
+        metadata = FileRecord.from_google_file(files[file_id])
+        download_file(metadata, inputs, api, store=store)
+        # Append the file record to the download files array
         downloaded_files.append(metadata)
     # Generate and inventory report from the downloaded files array
-    generate_inventory_report(downloaded_files, inputs.output_dir)
+    report_path = generate_inventory_report(downloaded_files, inputs.output_dir, inputs.report_format)
+    # Write the performance metrics of the run next to the report
+    api.instrumentation.export(report_path, inputs.metrics)
+    # Print the API request statistics of the run
+    api.log_summary()
     # Print that the transfer has completed
     logging.info("Transfer Completed")
 
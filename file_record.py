@@ -0,0 +1,89 @@
+import enum
+import time
+
+from google_drive_api import *
+
+
+class FileStatus(enum.Enum):
+    """
+    The transfer status of a file as shown in the inventory report
+    """
+    NOT_APPLICABLE = "Not Applicable"
+    DOWNLOAD_ERROR = "Download Error"
+    VERIFICATION_SKIPPED = "File Verification Skipped"
+    CHECKSUM_VERIFIED = "Checksum Verified"
+    CHECKSUM_MISMATCHED = "Checksum Mismatched"
+    VERIFICATION_ERROR = "Checksum Verification Error"
+    UNCHANGED = "File Unchanged Since Last Download"
+    SIZE_AND_TIME_MATCHED = "File Size And Modified Time Matched"
+    DUPLICATE_COPIED = "Copied From Verified Duplicate"
+    METADATA_ERROR = "Metadata Lookup Error"
+
+
+class FileRecord:
+    """
+    Compact inventory entry of a file, used in place of the Google Drive metadata map to keep the memory use and the
+    serialized size of large inventories low
+    """
+    __slots__ = ['name', 'google_id', 'md5', 'size', 'modified_time', 'path', 'access_time', 'status']
+
+    def __init__(self, name, google_id, md5=None, size=None, modified_time=None, path=None, access_time=None,
+                 status=FileStatus.NOT_APPLICABLE):
+        """
+        Initialize a file record
+        :param name: The file name
+        :param google_id: The Google ID of the file
+        :param md5: The MD5 checksum of the file, Google Workspace files do not have one
+        :param size: The integer size of the file in bytes, Google Workspace files do not have one
+        :param modified_time: The last modified time of the file as a POSIX timestamp
+        :param path: The path of the file relative to the output directory
+        :param access_time: The time the file metadata was queried as a POSIX timestamp
+        :param status: The transfer status of the file
+        """
+        self.name = name
+        self.google_id = google_id
+        self.md5 = md5
+        self.size = size
+        self.modified_time = modified_time
+        self.path = path
+        self.access_time = access_time if access_time is not None else time.time()
+        self.status = status
+
+    @classmethod
+    def from_google_file(cls, google_file, path=None):
+        """
+        Creates a file record from the file specific attributes of a Google Drive file
+        :param google_file: The Google Drive metadata of the file
+        :param path: The path of the file relative to the output directory
+        :return: The generated file record
+        """
+        size = google_file.get(GOOGLE_FILE_SIZE)
+        modified_time = google_file.get(GOOGLE_FILE_LAST_MODIFIED)
+        return cls(
+            google_file[GOOGLE_FILE_NAME],
+            google_file[GOOGLE_FILE_ID],
+            md5=google_file.get(GOOGLE_FILE_MD5),
+            size=int(size) if size is not None else None,
+            modified_time=google_time_string_to_datetime(modified_time).timestamp() if modified_time else None,
+            path=path
+        )
+
+    @classmethod
+    def from_list(cls, values):
+        """
+        Creates a file record from the list generated by to_list
+        :param values: The list of record values
+        :return: The generated file record
+        """
+        name, google_id, md5, size, modified_time, path, access_time, status = values
+        return cls(name, google_id, md5, size, modified_time, path, access_time, FileStatus(status))
+
+    def to_list(self):
+        """
+        Returns the record values as a list that can be serialized
+        :return: The list of record values
+        """
+        return [
+            self.name, self.google_id, self.md5, self.size, self.modified_time, self.path, self.access_time,
+            self.status.value
+        ]
@@ -1,88 +1,325 @@
+import concurrent.futures
 import os.path
-import pickle
 import shutil
+from checksum_verification import calculate_checksums
+from content_store import ContentStore
 from download_metrics import Metrics
-from file_download import download_file
+from download_queue import DownloadQueue
+from file_download import *
 from folder_inventory import *
-from google_authentication import authenticate_service_account
+from google_authentication import authenticate_service_accounts
 from google_drive_api import *
+from metadata_index import MetadataIndex
+from progress_journal import ProgressJournal
 
-INVENTORY_KEY = "inventory"
-DOWNLOADED_KEY = "downloaded"
+# Number of files per worker and minimum total number of files that can be waiting in the download queue, a
+# larger queue lets the files be ordered by size over more of the inventory
+QUEUED_FILES_PER_WORKER = 4
+QUEUE_SIZE = 1000
+# Number of files that are checked against the output directory or the metadata index at a time
+BATCH_SIZE = 1000
+# Name of the file in the tmp directory recording the paths of the inventory report of the transfer
+REPORT_STATE_FILE = 'report.json'
 
 
-def serialize(obj, dump_file):
+def stream_inventory(api, root_folder, workers, journal, metrics):
     """
-    Serializes the provided object and writes it to the specified file path
-    :param obj: The object to be serialized
-    :param dump_file: The file path to which the serialized object is written
+    Traverses the specified folder and yields each file that has not been completed as soon as it is found, every
+    file is recorded in the progress journal and added to the download metrics as it is found
+    :param api: Thread-safe Google Drive API connection
+    :param root_folder: The metadata map of the folder to inventory including its path
+    :param workers: The maximum number of folders that are listed concurrently
+    :param journal: The progress journal of the transfer
+    :param metrics: The download metrics object of the transfer
+    :return: A generator of file records for the files to be downloaded
     """
-    path = os.path.dirname(dump_file)
-    if not os.path.exists(path):
-        os.makedirs(path)
-    dump_file = open(dump_file, 'wb')
-    pickle.dump(obj, dump_file, pickle.HIGHEST_PROTOCOL)
-    dump_file.close()
+    for metadata in iterate_folder_contents(api, root_folder, workers):
+        # Skip the files completed by a run that was interrupted before the inventory finished
+        if journal.is_done(metadata):
+            continue
+        journal.record_file(metadata)
+        metrics.add_file(metadata.size or 0)
+        yield metadata
+    # Record that the inventory is complete so that a resumed transfer does not need to traverse the folder again
+    journal.record_listed()
 
 
-def deserialize(folder_id):
+def iterate_batches(files, batch_size):
     """
-    Deserializes an object found at the path 'tmp/<folder_id>.dump.tmp' and then returns the object
-    :param folder_id: The folder_id used to identify the object to deserialize
-    :return: The deserialized object
+    Groups the provided files into batches
+    :param files: An iterable of file records
+    :param batch_size: The maximum number of files in a batch
+    :return: A generator of file record arrays
     """
-    dump_name = os.path.join('tmp', '{}.dump.tmp'.format(folder_id))
-    dump_file = open(dump_name, 'rb')
-    return pickle.load(dump_file)
+    batch = []
+    for metadata in files:
+        batch.append(metadata)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def skip_unchanged_files(inventory, report, inputs, index, journal, metrics):
+    """
+    Moves the inventory files that still exist locally and are unchanged since they were last downloaded to the
+    downloaded files array
+    :param inventory: The record array of the files remaining to be downloaded
+    :param report: The inventory report to which the completed files are added
+    :param inputs: User inputs object
+    :param index: The metadata index recording the previously downloaded files
+    :param journal: The progress journal of the transfer
+    :param metrics: The download metrics object of the transfer
+    """
+    # Files that are missing or have the wrong size, for example after an interrupted copy, are downloaded again
+    unchanged_files = [
+        metadata for metadata in inventory
+        if index.is_unchanged(metadata) and
+        compare_local_file(get_output_path(metadata, inputs), metadata) in [LOCAL_FILE_MATCHED, LOCAL_FILE_AMBIGUOUS]
+    ]
+    for metadata in unchanged_files:
+        metadata.status = FileStatus.UNCHANGED
+        report.append(metadata)
+        journal.record_done(metadata)
+        metrics.remove_file(metadata.size or 0)
+    logging.info("Skipping {} files unchanged since they were last downloaded".format(len(unchanged_files)))
+    # Remove the unchanged files from the inventory
+    unchanged_ids = {id(metadata) for metadata in unchanged_files}
+    inventory[:] = [metadata for metadata in inventory if id(metadata) not in unchanged_ids]
+
+
+def verify_existing_files(inventory, report, inputs, journal, metrics, index=None, instrumentation=None,
+                          store=None):
+    """
+    Verifies the inventory files that already exist in the output directory, files with the size and the modified time
+    they were given when they were last verified are matched without being read and the checksums of the other files
+    with the right size are calculated using a pool of processes, the matched and verified files are moved from the
+    inventory array to the downloaded files array while the files with the wrong size are left to be downloaded again
+    :param inventory: The record array of the files remaining to be downloaded
+    :param report: The inventory report to which the completed files are added
+    :param inputs: User inputs object
+    :param journal: The progress journal of the transfer
+    :param metrics: The download metrics object of the transfer
+    :param index: If provided, the metadata index in which verified files are recorded
+    :param instrumentation: If provided, the run instrumentation in which the verification times are recorded
+    :param store: If provided, the content store in which the matched and verified files are recorded
+    """
+    matched_files = []
+    existing_files = []
+    for metadata in inventory:
+        # A hard linked copy is matched by the modified time recorded in the index when its checksum was verified
+        verified_mtime = index.get_verified_mtime(metadata) if index else None
+        comparison = compare_local_file(get_output_path(metadata, inputs), metadata, verified_mtime)
+        if comparison == LOCAL_FILE_MATCHED:
+            matched_files.append(metadata)
+        elif comparison == LOCAL_FILE_AMBIGUOUS:
+            existing_files.append(metadata)
+    if matched_files:
+        logging.info("Matched {} files by size and modified time".format(len(matched_files)))
+    for metadata in matched_files:
+        if instrumentation:
+            instrumentation.increment(MATCHED_FILES)
+        metadata.status = FileStatus.SIZE_AND_TIME_MATCHED
+        if index:
+            index.mark_downloaded(metadata, get_output_path(metadata, inputs))
+        if store:
+            store.add(metadata, get_output_path(metadata, inputs))
+        report.append(metadata)
+        journal.record_done(metadata)
+        metrics.remove_file(metadata.size or 0)
+    paths = [get_output_path(metadata, inputs) for metadata in existing_files]
+    results = calculate_checksums(paths)
+    for path, metadata, (calculated_md5, error, duration) in zip(paths, existing_files, results):
+        if instrumentation:
+            instrumentation.observe(FILE_VERIFY_SECONDS, duration)
+            if error is None:
+                instrumentation.increment(VERIFIED_FILES)
+                instrumentation.increment(VERIFIED_BYTES, os.path.getsize(path))
+        if error is not None:
+            logging.error("An error occurred while verifying checksum of file: {}".format(os.path.basename(path)))
+            logging.error(error)
+            metadata.status = FileStatus.VERIFICATION_ERROR
+        else:
+            verify_file(path, metadata, calculated_md5)
+        if metadata.status == FileStatus.CHECKSUM_VERIFIED:
+            if index:
+                index.mark_downloaded(metadata, path)
+            if store:
+                store.add(metadata, path)
+        report.append(metadata)
+        journal.record_done(metadata)
+        metrics.remove_file(metadata.size or 0)
+    # Remove the matched and verified files from the inventory
+    verified_ids = {id(metadata) for metadata in matched_files + existing_files}
+    inventory[:] = [metadata for metadata in inventory if id(metadata) not in verified_ids]
+
+
+def download_inventory(files, report, inputs, api, journal, metrics, index=None, store=None, cancelled=None):
+    """
+    Downloads and verifies the provided files using a pool of concurrent workers, the files are consumed as they are
+    produced so downloading can start while the inventory is still in progress, and the waiting files are handed to
+    the workers by size so that large files start early and small files fill the gaps
+    :param files: An iterable of the records of the files remaining to be downloaded
+    :param report: The inventory report to which the completed files are added
+    :param inputs: User inputs object
+    :param api: Thread-safe Google Drive API connection
+    :param journal: The progress journal in which every completed file is recorded
+    :param metrics: The download metrics object of the transfer
+    :param index: If provided, the metadata index in which verified files are recorded
+    :param store: If provided, the content store used to download files with the same contents only once
+    :param cancelled: If provided, an event that stops the transfer once it is set, the waiting files are discarded
+    and no other file is started
+    """
+    # Start the download metrics object
+    metrics.log_start()
+    # Limit the number of files waiting in the queue so that memory use stays bounded
+    queue = DownloadQueue(
+        max(QUEUE_SIZE, inputs.workers * QUEUED_FILES_PER_WORKER), inputs.workers, metrics, api.instrumentation
+    )
+
+    def download_worker():
+        try:
+            task = queue.get()
+            while task is not None:
+                metadata, large = task
+                try:
+                    if cancelled is not None and cancelled.is_set():
+                        # Stop the other workers and the producer without starting any more files
+                        queue.abort()
+                        return
+                    transfer_file(metadata)
+                finally:
+                    queue.task_done(large)
+                task = queue.get()
+        except BaseException:
+            # Stop the other workers and the producer so that the error is raised without waiting for the transfer
+            queue.abort()
+            raise
+
+    def transfer_file(metadata):
+        start_time = time.monotonic()
+        # Files that changed since they were last downloaded are always downloaded again
+        downloaded = download_file(metadata, inputs, api, index is not None and index.is_changed(metadata), store)
+        duration = time.monotonic() - start_time
+        if index and metadata.status in [
+            FileStatus.CHECKSUM_VERIFIED, FileStatus.SIZE_AND_TIME_MATCHED, FileStatus.DUPLICATE_COPIED
+        ]:
+            index.mark_downloaded(metadata, get_output_path(metadata, inputs))
+        try:
+            # Only downloads measure the throughput, the files that were kept, verified or duplicated locally or that
+            # failed transferred no bytes and are removed from the data to be downloaded
+            if not downloaded:
+                metrics.remove_file(metadata.size or 0)
+            else:
+                # Update the metrics object estimate and then retrieve it
+                estimate = metrics.update_estimate(metadata.size or 0, duration)
+                bytes_per_second, files_per_second = metrics.get_throughput()
+                # Print the estimated time remaining generated by the metrics object
+                logging.info("Estimated Time Remaining: {} ({:.1f} MB/s, {:.1f} files/s)".format(
+                    estimate, bytes_per_second / 1000000, files_per_second
+                ))
+        except Exception as ex:
+            logging.error("An error occurred while generating remaining time estimate")
+            logging.error(ex)
+        report.append(metadata)
+        # Save progress
+        journal.record_done(metadata)
+
+    # Files are checked against the output directory or the metadata index in batches before they are downloaded
+    batch_size = BATCH_SIZE if inputs.mode == VERIFY_MODE or index else 1
+    with concurrent.futures.ThreadPoolExecutor(max_workers=inputs.workers) as executor:
+        workers = [executor.submit(download_worker) for _ in range(inputs.workers)]
+        try:
+            for batch in iterate_batches(files, batch_size):
+                if cancelled is not None and cancelled.is_set():
+                    break
+                # In verify mode the files that already exist are verified in bulk before downloading the rest
+                if inputs.mode == VERIFY_MODE:
+                    verify_existing_files(
+                        batch, report, inputs, journal, metrics, index, api.instrumentation, store
+                    )
+                # Otherwise the files that are unchanged since they were last downloaded are not downloaded again
+                elif index:
+                    skip_unchanged_files(batch, report, inputs, index, journal, metrics)
+                # Hand the files to the workers, waiting while the queue is full, the queue is only closed early if a
+                # worker failed
+                if not all(queue.put(metadata) for metadata in batch):
+                    break
+        finally:
+            queue.close()
+        # Wait for the workers to finish and raise any unexpected worker errors
+        for future in workers:
+            future.result()
 
 
 def main(inputs):
-    # Create service account credentials
-    credentials = authenticate_service_account()
-    # Create Google Drive API connection using service account credentials
-    api = API(credentials)
-    # Create an array to store the downloaded files metadata
-    downloaded_files = []
+    # Create the credentials of each service account
+    credentials = authenticate_service_accounts(inputs.service_account)
+    # Create a Google Drive API connection that spreads the requests over the service accounts, each worker gets its
+    # own connection for each account
+    api = PooledAPI(
+        credentials,
+        inputs.requests_per_minute,
+        chunk_size=inputs.chunk_size * BYTES_IN_MIB,
+        connections=inputs.connections
+    )
+    # Open the metadata index if one is specified
+    index = MetadataIndex(inputs.index) if inputs.index else None
+    # Create the content store if files with the same contents are only downloaded once
+    store = None
+    if inputs.dedup:
+        store = ContentStore(inputs.dedup)
+        # The files downloaded by previous runs can be duplicated instead of downloading their contents again
+        if index:
+            for md5, size, path in index.get_downloaded_files():
+                store.add_existing(md5, size, os.path.join(inputs.output_dir, path))
+    # Create the inventory report to which each file is written as it is completed, the report paths are saved with
+    # the progress journals so that a resumed transfer keeps writing to the same report
+    report = InventoryReport(inputs.output_dir, inputs.report_format, os.path.join('tmp', REPORT_STATE_FILE))
     # Loop through each provided Google ID
     for folder_id in inputs.google_id:
-        # Create dump file path and create folder structure if necessary
-        dump_file = os.path.join('tmp', '{}.dump.tmp'.format(folder_id))
-        if os.path.exists(dump_file):
+        # Open the progress journal, creating the folder structure if necessary
+        journal = ProgressJournal(os.path.join('tmp', '{}.journal'.format(folder_id)))
+        if journal.listed or journal.downloaded:
             logging.info("Resuming a previously interrupted transfer")
-            serialized_map = deserialize(folder_id)
-            inventory = serialized_map[INVENTORY_KEY]
-            downloaded_files = serialized_map[DOWNLOADED_KEY]
+            # The files completed by the interrupted run are added unless they were already written to the report
+            report.extend(journal.downloaded)
         else:
             logging.info("Beginning transfer")
-            inventory = get_folder_contents(api, folder_id)
-        # Initialize and start the download metrics object for the inventory array
-        metrics = Metrics(inventory)
-        metrics.log_start()
-        # Get file metadata array using the current Google ID
-        while len(inventory) > 0:
-            # Save progress
-            serialize({INVENTORY_KEY: inventory, DOWNLOADED_KEY: downloaded_files}, dump_file)
-            # Get target file metadata from inventory object
-            metadata = inventory.pop()
-            # Assemble the full file path and then store the folder path and file name in variables
-            download_file(metadata, inputs, api)
-            try:
-                # Update the metrics object estimate and then retrieve it
-                estimate = metrics.update_estimate(metadata[GOOGLE_FILE_SIZE])
-                # Print the estimated time remaining generated by the metrics object
-                logging.info("Estimated Time Remaining: {}".format(estimate))
-            except Exception as ex:
-                logging.error(
-                    "An error occurred while generating remaining time estimate".format(metadata[GOOGLE_FILE_NAME])
-                )
-                logging.error(ex)
-            downloaded_files.append(metadata)
-        # Save empty inventory to signify this folder has completed in case of interruption
-        serialize({INVENTORY_KEY: inventory, DOWNLOADED_KEY: downloaded_files}, dump_file)
-    # Download has completed so the tmp directory with the progress dump files can be deleted
+        if journal.listed:
+            # The inventory was completed by the interrupted run
+            files = journal.get_pending()
+            metrics = Metrics(files)
+        elif index:
+            files = index.sync(api, folder_id, inputs.workers)
+            if files is None:
+                journal.close()
+                continue
+            # Record the inventory so that an interrupted transfer can resume without syncing the folder again
+            journal.record_inventory(files)
+            metrics = Metrics(files)
+        else:
+            root_folder = get_root_folder(api, folder_id)
+            if root_folder is None:
+                journal.close()
+                continue
+            # Download the files while the folder is still being traversed
+            metrics = Metrics([])
+            files = stream_inventory(api, root_folder, inputs.workers, journal, metrics)
+        # Download the files
+        download_inventory(files, report, inputs, api, journal, metrics, index, store)
+        journal.close()
+    # Write the remaining files to the inventory report
+    report_path = report.close()
+    # Download has completed so the tmp directory with the progress journals can be deleted
     shutil.rmtree('tmp')
-    # Generate and inventory report from the downloaded files array
-    generate_inventory_report(downloaded_files, inputs.output_dir)
+    if index:
+        index.close()
+    # Write the performance metrics of the run next to the report
+    api.instrumentation.export(report_path, inputs.metrics)
+    # Print the API request statistics of the run
+    api.log_summary()
     # Print that the transfer has completed
     logging.info("Transfer Completed")
 
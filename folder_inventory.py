@@ -1,123 +1,430 @@
 import argparse
+import concurrent.futures
 import csv
+import importlib.util
+import json
 import os.path
+import threading
 from datetime import datetime
 from googleapiclient.errors import HttpError
-from google_authentication import authenticate_service_account
+from content_store import DEDUP_METHODS
+from file_record import *
+from google_authentication import DEFAULT_KEY_FILE, authenticate_service_accounts
 from google_drive_api import *
 
 FILE_PATH = "path"
-FILE_STATUS = "status"
-ACCESS_TIME = "access time"
+PARENT_ID = "parent id"
 FOLDER_TYPE = "application/vnd.google-apps.folder"
 TIME_FORMAT = "%Y-%m-%dT%H-%M"
 OVERWRITE_MODE = 'overwrite'
 VERIFY_MODE = 'verify'
 SKIP_MODE = 'skip'
 MODES = [OVERWRITE_MODE, VERIFY_MODE, SKIP_MODE]
+# Roles of the processes of a distributed download
+COORDINATOR_ROLE = 'coordinator'
+WORKER_ROLE = 'worker'
+DISTRIBUTED_ROLES = [COORDINATOR_ROLE, WORKER_ROLE]
+# Formats in which the inventory report can be written
+CSV_REPORT = 'csv'
+JSONL_REPORT = 'jsonl'
+REPORT_FORMATS = [CSV_REPORT, JSONL_REPORT]
+# Name of the report if there are no files to take the root folder name from
+DEFAULT_REPORT_NAME = 'File-Download-Report'
+# Ordered list of the report column names
+REPORT_HEADER = [
+    "File Name",
+    "File Path",
+    "Status",
+    "Last Modified",
+    "Time Accessed",
+    "Size",
+    "MD5 Checksum",
+    "Google ID"
+]
+# Number of records and number of seconds after which buffered report records are written
+REPORT_FLUSH_RECORDS = 1000
+REPORT_FLUSH_INTERVAL = 5
+DEFAULT_WORKERS = 1
 
 
-def get_folder_contents(api, folder_id):
+def get_folder_contents(api, folder_id, workers=DEFAULT_WORKERS, folders=None):
     """
     Traverses the specified folder and all sub-folders and collects metadata for all encountered files
-    :param api: The Google Drive API connection object
+    :param api: The Google Drive API connection object, this must be thread-safe if more than one worker is used
     :param folder_id: The Google Drive id of the folder to inventory
-    :return: A list of metadata maps for all files contained in the specified folder and its sub-folders
+    :param workers: The maximum number of folders that are listed concurrently
+    :param folders: If provided, the metadata of every traversed folder is appended to this array
+    :return: A list of file records for all files contained in the specified folder and its sub-folders
     """
     # Verify the specified folder exists and query its metadata
+    root_folder = get_root_folder(api, folder_id)
+    # Traverse specified folder and sub-folders
+    inventory = None
+    if root_folder:
+        inventory = list(iterate_folder_contents(api, root_folder, workers, folders))
+    # Return the file metadata inventory
+    return inventory
+
+
+def get_root_folder(api, folder_id):
+    """
+    Queries the metadata of the folder to inventory
+    :param api: The Google Drive API connection object
+    :param folder_id: The Google Drive id of the folder to inventory
+    :return: The metadata map of the folder including its path, or None if the folder could not be accessed
+    """
     root_folder = None
     try:
         root_folder = api.get_folder_by_id(folder_id)
+        root_folder[FILE_PATH] = root_folder[GOOGLE_FILE_NAME]
     except HttpError as error:
         logging.error("Unable to access folder with ID: {}".format(folder_id))
         logging.error(error)
-    # Traverse specified folder and sub-folders
-    inventory = None
-    if root_folder:
-        inventory = []
-        root_folder[FILE_PATH] = root_folder[GOOGLE_FILE_NAME]
-        folder_queue = [root_folder]
+    return root_folder
+
+
+def iterate_folder_contents(api, root_folder, workers=DEFAULT_WORKERS, folders=None):
+    """
+    Traverses the specified folder and all sub-folders breadth first and yields the record of each file as soon as
+    its folder has been listed, up to the specified number of folders are listed at once
+    :param api: The Google Drive API connection object, this must be thread-safe if more than one worker is used
+    :param root_folder: The metadata map of the folder to inventory including its path
+    :param workers: The maximum number of folders that are listed concurrently
+    :param folders: If provided, the metadata of every traversed folder is appended to this array
+    :return: A generator of file records for all files contained in the folder and its sub-folders
+    """
+    if folders is not None:
+        folders.append(root_folder)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {executor.submit(get_folder_children, api, root_folder)}
         # Loop while there are still un-traversed folders
-        while len(folder_queue) != 0:
-            current_folder = folder_queue.pop()
-            try:
-                # Query folder contents
-                folder_children = api.get_children_by_id(current_folder[GOOGLE_FILE_ID])
-                logging.info("Opening folder {}".format(current_folder[GOOGLE_FILE_NAME]))
-                # Loop through folder contents
-                for child in folder_children:
-                    path = "{}/{}".format(current_folder[FILE_PATH], child[GOOGLE_FILE_NAME])
-                    # Check if current object is a sub-folder or a file
-                    if child[GOOGLE_FILE_MIMETYPE] == FOLDER_TYPE:
-                        # Add sub-folder to the folder queue to be traversed later
-                        child[FILE_PATH] = path
-                        folder_queue.append(child)
-                        logging.info("Found sub-folder {}".format(child[GOOGLE_FILE_NAME]))
-                    else:
-                        # Query file specific attributes and then save to the metadata to the inventory array
-                        file = api.get_file_by_id(child[GOOGLE_FILE_ID])
-                        file[FILE_PATH] = path
-                        last_modified_datetime = google_time_string_to_datetime(file[GOOGLE_FILE_LAST_MODIFIED])
-                        file[GOOGLE_FILE_LAST_MODIFIED] = last_modified_datetime.strftime(TIME_FORMAT)
-                        file[ACCESS_TIME] = datetime.datetime.now().strftime(TIME_FORMAT)
-                        file[FILE_STATUS] = "Not Applicable"
-                        inventory.append(file)
-                        logging.info("Found file {}".format(child[GOOGLE_FILE_NAME]))
-            except HttpError as error:
-                logging.error("Unable to access entity with ID: {} in path: {}"
-                              .format(current_folder[GOOGLE_FILE_ID], current_folder[FILE_PATH]))
-                logging.error(error)
-    # Return the file metadata inventory
+        while len(pending) != 0:
+            api.instrumentation.set_gauge(FOLDER_QUEUE_DEPTH, len(pending))
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                files, sub_folders = future.result()
+                # Add the sub-folders to the pool to be traversed
+                for sub_folder in sub_folders:
+                    pending.add(executor.submit(get_folder_children, api, sub_folder))
+                    if folders is not None:
+                        folders.append(sub_folder)
+                for file in files:
+                    yield file
+
+
+def get_folder_children(api, folder):
+    """
+    Lists the contents of a single folder and separates them into file records and sub-folders
+    :param api: The Google Drive API connection object
+    :param folder: The Google Drive metadata of the folder, including its path
+    :return: A tuple of the folder's file record array and sub-folder metadata array
+    """
+    try:
+        # Query folder contents
+        folder_children = api.get_children_by_id(folder[GOOGLE_FILE_ID])
+        logging.info("Opening folder {}".format(folder[GOOGLE_FILE_NAME]))
+        return split_folder_children(folder, folder_children)
+    except HttpError as error:
+        logging.error("Unable to access entity with ID: {} in path: {}"
+                      .format(folder[GOOGLE_FILE_ID], folder[FILE_PATH]))
+        logging.error(error)
+    return [], []
+
+
+def split_folder_children(folder, folder_children):
+    """
+    Separates the listed contents of a folder into file records and sub-folders
+    :param folder: The Google Drive metadata of the folder, including its path
+    :param folder_children: The Google Drive metadata array of the folder's children
+    :return: A tuple of the folder's file record array and sub-folder metadata array
+    """
+    files = []
+    sub_folders = []
+    # Loop through folder contents
+    for child in folder_children:
+        path = "{}/{}".format(folder[FILE_PATH], child[GOOGLE_FILE_NAME])
+        # Check if current object is a sub-folder or a file
+        if child[GOOGLE_FILE_MIMETYPE] == FOLDER_TYPE:
+            # Add sub-folder to the sub-folder array to be traversed later
+            child[FILE_PATH] = path
+            child[PARENT_ID] = folder[GOOGLE_FILE_ID]
+            sub_folders.append(child)
+            logging.info("Found sub-folder {}".format(child[GOOGLE_FILE_NAME]))
+        else:
+            # Save the file specific attributes returned by the list call to the file array
+            files.append(create_file_metadata(child, path))
+            logging.info("Found file {}".format(child[GOOGLE_FILE_NAME]))
+    return files, sub_folders
+
+
+async def get_folder_contents_async(api, folder_id, workers=DEFAULT_WORKERS):
+    """
+    Traverses the specified folder and all sub-folders with the asyncio Google Drive client and collects metadata for
+    all encountered files
+    :param api: The asyncio Google Drive API client
+    :param folder_id: The Google Drive id of the folder to inventory
+    :param workers: The maximum number of folders that are listed concurrently
+    :return: A list of file records for all files contained in the specified folder and its sub-folders
+    """
+    # Verify the specified folder exists and query its metadata
+    try:
+        root_folder = await api.get_folder_by_id(folder_id)
+        root_folder[FILE_PATH] = root_folder[GOOGLE_FILE_NAME]
+    except HttpError as error:
+        logging.error("Unable to access folder with ID: {}".format(folder_id))
+        logging.error(error)
+        return None
+    # Imported here so that the entry points that do not use the asyncio client start quickly
+    import asyncio
+    inventory = []
+    semaphore = asyncio.Semaphore(workers)
+
+    async def traverse(folder):
+        # Only the listing holds a worker slot so that waiting on sub-folders does not block other folders
+        async with semaphore:
+            files, sub_folders = await get_folder_children_async(api, folder)
+        inventory.extend(files)
+        await asyncio.gather(*[traverse(sub_folder) for sub_folder in sub_folders])
+
+    await traverse(root_folder)
     return inventory
 
 
-def generate_inventory_report(folder_inventory, output_dir):
+async def get_folder_children_async(api, folder):
     """
-    Writes an inventory report using the supplied file metadata array
-    :param folder_inventory: An array of file metadata
-    :param output_dir: The output directory for the report
+    Lists the contents of a single folder with the asyncio Google Drive client and separates them into file records and
+    sub-folders
+    :param api: The asyncio Google Drive API client
+    :param folder: The Google Drive metadata of the folder, including its path
+    :return: A tuple of the folder's file record array and sub-folder metadata array
     """
-    # Use the path attribute from a file in the folder inventory to get the root folder name
-    root_name = None
     try:
-        root_name = (folder_inventory[0][FILE_PATH]).split('/')[0]
-    except Exception as ex:
-        root_name = 'File-Download-Report'
-    # Create the folder inventory report name string
-    file_name = "{}/{}.{}.csv".format(output_dir, root_name, datetime.datetime.now().strftime(TIME_FORMAT))
-    logging.info("Writing report {}".format(file_name))
-    # Create an ordered list of the attributes to include in the inventory report
-    attributes = [
-        GOOGLE_FILE_NAME,
-        FILE_PATH,
-        FILE_STATUS,
-        GOOGLE_FILE_LAST_MODIFIED,
-        ACCESS_TIME,
-        GOOGLE_FILE_SIZE,
-        GOOGLE_FILE_MD5,
-        GOOGLE_FILE_ID
+        # Query folder contents
+        folder_children = await api.get_children_by_id(folder[GOOGLE_FILE_ID])
+        logging.info("Opening folder {}".format(folder[GOOGLE_FILE_NAME]))
+        return split_folder_children(folder, folder_children)
+    except HttpError as error:
+        logging.error("Unable to access entity with ID: {} in path: {}"
+                      .format(folder[GOOGLE_FILE_ID], folder[FILE_PATH]))
+        logging.error(error)
+    return [], []
+
+
+def create_file_metadata(google_file, path):
+    """
+    Creates an inventory file record from the file specific attributes of a Google Drive file
+    :param google_file: The Google Drive metadata of the file
+    :param path: The path of the file relative to the output directory
+    :return: The inventory file record of the file
+    """
+    return FileRecord.from_google_file(google_file, path)
+
+
+def format_timestamp(timestamp):
+    """
+    Formats a POSIX timestamp as a local time string for the inventory report
+    :param timestamp: The POSIX timestamp
+    :return: The formatted time string, or an empty string if there is no timestamp
+    """
+    if timestamp is None:
+        return ''
+    return datetime.datetime.fromtimestamp(timestamp).strftime(TIME_FORMAT)
+
+
+def get_report_row(file):
+    """
+    Returns the inventory report columns of a file
+    :param file: The file record
+    :return: The list of column values in the order of the report header
+    """
+    return [
+        file.name,
+        file.path,
+        file.status.value,
+        format_timestamp(file.modified_time),
+        format_timestamp(file.access_time),
+        file.size,
+        file.md5,
+        file.google_id
     ]
-    # Create a map of the attributes to display names for the report
-    attribute_name_map = {
-        GOOGLE_FILE_NAME: "File Name",
-        FILE_PATH: "File Path",
-        GOOGLE_FILE_SIZE: "Size",
-        GOOGLE_FILE_MD5: "MD5 Checksum",
-        GOOGLE_FILE_ID: "Google ID",
-        GOOGLE_FILE_LAST_MODIFIED: "Last Modified",
-        ACCESS_TIME: "Time Accessed",
-        FILE_STATUS: "Status"
-    }
-    # Write folder inventory to CSV
-    with open(file_name, 'w') as csvfile:
-        csvwriter = csv.DictWriter(csvfile, lineterminator='\n', fieldnames=attributes)
-        csvwriter.writerow(attribute_name_map)
-        csvwriter.writerows(folder_inventory)
-
-
-def parse_arguments():
+
+
+class InventoryReport:
+
+    def __init__(self, output_dir, formats=None, state_path=None):
+        """
+        Initialize an inventory report that is written incrementally as files are added, the records are buffered and
+        flushed in batches so that the report can be read while a transfer is in progress and memory use does not grow
+        with the number of files
+        :param output_dir: The output directory for the report
+        :param formats: The formats in which the report is written, defaults to CSV
+        :param state_path: If provided, the file in which the report paths and the sizes they had at the last write are
+        saved so that a resumed transfer keeps appending to the reports of the interrupted run
+        """
+        self.output_dir = output_dir
+        self.formats = formats or [CSV_REPORT]
+        self.state_path = state_path
+        self.lock = threading.Lock()
+        self.paths = {}
+        self.files = {}
+        self.writers = {}
+        self.buffer = []
+        self.last_flush = time.monotonic()
+        # Keys of the files already written by an interrupted run, which are not written again
+        self.written_keys = set()
+        if state_path and os.path.exists(state_path):
+            with open(state_path) as f:
+                state = json.load(f)
+            paths = state.get('paths', {})
+            offsets = state.get('offsets', {})
+            if all(
+                os.path.exists(paths.get(report_format, '')) and report_format in offsets
+                for report_format in self.formats
+            ):
+                for report_format in self.formats:
+                    self.resume(report_format, paths[report_format], offsets[report_format])
+
+    @staticmethod
+    def get_key(file):
+        """
+        Returns the key identifying a file within the report
+        :param file: The file record
+        :return: The tuple of the Google ID and path of the file
+        """
+        return file.google_id, file.path or ''
+
+    def resume(self, report_format, path, offset):
+        """
+        Reopens a report written by an interrupted run, the rows written after the last saved write are discarded as
+        the last of them may be partial, the files of the discarded rows are added again by the resumed transfer
+        :param report_format: The format of the report
+        :param path: The path of the report
+        :param offset: The size of the report at the last saved write
+        """
+        logging.info("Resuming report {}".format(path))
+        if offset < os.path.getsize(path):
+            with open(path, 'r+b') as f:
+                f.truncate(offset)
+        with open(path, newline='') as f:
+            if report_format == CSV_REPORT:
+                rows = csv.reader(f)
+                next(rows, None)
+                self.written_keys.update((row[7], row[1]) for row in rows)
+            else:
+                for line in f:
+                    row = json.loads(line)
+                    self.written_keys.add((row["Google ID"], row["File Path"] or ''))
+        self.paths[report_format] = path
+        self.files[report_format] = open(path, 'a', newline='')
+        self.writers[report_format] = csv.writer(self.files[report_format], lineterminator='\n')
+
+    def open(self, root_name):
+        """
+        Creates the report files named after the root folder and writes the CSV header
+        :param root_name: The name of the root folder
+        """
+        base_path = "{}/{}.{}".format(self.output_dir, root_name, datetime.datetime.now().strftime(TIME_FORMAT))
+        for report_format in self.formats:
+            path = "{}.{}".format(base_path, report_format)
+            logging.info("Writing report {}".format(path))
+            self.paths[report_format] = path
+            self.files[report_format] = open(path, 'w', newline='')
+            self.writers[report_format] = csv.writer(self.files[report_format], lineterminator='\n')
+            if report_format == CSV_REPORT:
+                self.writers[report_format].writerow(REPORT_HEADER)
+        self.sync()
+
+    def append(self, file):
+        """
+        Adds a file to the report
+        :param file: The file record
+        """
+        self.extend([file])
+
+    def extend(self, files):
+        """
+        Adds files to the report, the buffered files are written once enough files are buffered or enough time has
+        passed since the last write
+        :param files: An iterable of file records
+        """
+        with self.lock:
+            for file in files:
+                if self.written_keys and self.get_key(file) in self.written_keys:
+                    continue
+                if not self.files:
+                    self.open(file.path.split('/')[0] if file.path else DEFAULT_REPORT_NAME)
+                self.buffer.append(get_report_row(file))
+                if len(self.buffer) >= REPORT_FLUSH_RECORDS:
+                    self.flush()
+            if self.buffer and time.monotonic() - self.last_flush >= REPORT_FLUSH_INTERVAL:
+                self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered files to every report format, must be called with the lock held
+        """
+        for report_format, f in self.files.items():
+            if report_format == CSV_REPORT:
+                self.writers[report_format].writerows(self.buffer)
+            else:
+                f.writelines(json.dumps(dict(zip(REPORT_HEADER, row))) + '\n' for row in self.buffer)
+        self.sync()
+        self.buffer = []
+        self.last_flush = time.monotonic()
+
+    def sync(self):
+        """
+        Flushes the report files and, if the reports can be resumed, syncs them to disk and saves their paths and sizes
+        so that a resumed transfer discards anything written after this point, must be called with the lock held
+        """
+        for f in self.files.values():
+            f.flush()
+        if not self.state_path:
+            return
+        offsets = {}
+        for report_format, f in self.files.items():
+            os.fsync(f.fileno())
+            offsets[report_format] = os.fstat(f.fileno()).st_size
+        # Replace the state file atomically so that it always holds a complete set of paths and sizes
+        temp_path = "{}.{}".format(self.state_path, os.getpid())
+        with open(temp_path, 'w') as f:
+            json.dump({'paths': self.paths, 'offsets': offsets}, f)
+        os.replace(temp_path, self.state_path)
+
+    def close(self):
+        """
+        Writes the remaining buffered files and closes the report
+        :return: The path of the report in the first format
+        """
+        with self.lock:
+            if not self.files:
+                self.open(DEFAULT_REPORT_NAME)
+            self.flush()
+            for f in self.files.values():
+                f.close()
+            self.written_keys = set()
+            return self.paths[self.formats[0]]
+
+
+def generate_inventory_report(folder_inventory, output_dir, formats=None):
+    """
+    Writes an inventory report using the supplied file record array
+    :param folder_inventory: An array of file records
+    :param output_dir: The output directory for the report
+    :param formats: The formats in which the report is written, defaults to CSV
+    :return: The path of the report in the first format
+    """
+    # The report is named after the root folder of the first file in the folder inventory
+    report = InventoryReport(output_dir, formats)
+    report.extend(folder_inventory)
+    return report.close()
+
+
+def parse_arguments(async_client=False):
     """
     Defines the accepted command line argument inputs and syntax then generates an argument parser
+    :param async_client: If true, the flag that lists the folders of the inventory with the asyncio client is accepted,
+    only the folder inventory has an asyncio client
     :return: The generated argument parser
     """
     parser = argparse.ArgumentParser()
@@ -128,7 +435,81 @@ def parse_arguments():
         help="File conflict resolution mode",
         choices=MODES, default='overwrite'
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "-a", "--service-account",
+        help="Service account key file, or folder of key files, can be repeated to spread the requests over several "
+             "accounts, defaults to {}".format(DEFAULT_KEY_FILE),
+        action='append'
+    )
+    parser.add_argument(
+        "-w", "--workers",
+        help="Number of folders to list or files to download and verify concurrently",
+        type=int, default=DEFAULT_WORKERS
+    )
+    parser.add_argument(
+        "-r", "--requests-per-minute",
+        help="Google Drive API request quota of the project",
+        type=int, default=QUOTA_REQUESTS_PER_MINUTE
+    )
+    parser.add_argument(
+        "-c", "--chunk-size",
+        help="Size in MiB of the byte range requested by each download request",
+        type=int, default=CHUNK_SIZE // BYTES_IN_MIB
+    )
+    parser.add_argument(
+        "-n", "--connections",
+        help="Number of connections used to download each file larger than {} MiB".format(
+            PARALLEL_THRESHOLD // BYTES_IN_MIB
+        ),
+        type=int, default=CONNECTIONS
+    )
+    parser.add_argument(
+        "--index",
+        help="SQLite metadata index file used by folder downloads to only sync changes since the previous run"
+    )
+    parser.add_argument(
+        "--dedup",
+        help="Download files with the same MD5 checksum and size once and create the other copies locally with the "
+             "specified method, hardlink and reflink fall back to a copy when the file system does not support them, "
+             "hard linked copies share one modified time so later verify runs read them again unless an index is used",
+        choices=DEDUP_METHODS
+    )
+    if async_client:
+        parser.add_argument(
+            "--async-client",
+            help="List folders for the inventory with the asyncio Google Drive client, which can list hundreds of "
+                 "folders concurrently over a pool of keep-alive connections, requires the aiohttp package",
+            action='store_true'
+        )
+    parser.add_argument(
+        "--report-format",
+        help="Format of the inventory report, can be repeated to write several formats",
+        choices=REPORT_FORMATS, action='append'
+    )
+    parser.add_argument(
+        "--metrics",
+        help="Format of the run performance metrics written next to the inventory report, can be repeated",
+        choices=METRICS_FORMATS, action='append'
+    )
+    parser.add_argument(
+        "--role",
+        help="Role of the process in a distributed download, the coordinator lists the folders and the workers on any "
+             "number of hosts download the files",
+        choices=DISTRIBUTED_ROLES
+    )
+    parser.add_argument(
+        "--queue",
+        help="SQLite shard queue file on a file system shared by the coordinator and the workers of a distributed "
+             "download"
+    )
+    inputs = parser.parse_args()
+    # Write a CSV report if no format is specified
+    if not inputs.report_format:
+        inputs.report_format = [CSV_REPORT]
+    # Write a JSON run summary if no format is specified
+    if not inputs.metrics:
+        inputs.metrics = [JSON_FORMAT]
+    return inputs
 
 
 def verify_args(inputs):
@@ -159,28 +540,100 @@ def verify_args(inputs):
     if not inputs.mode or inputs.mode not in MODES:
         logging.error("The mode argument is either missing or not specified")
         return False
+    # Check that the service account key files or folders exist
+    for key_path in inputs.service_account or []:
+        if not os.path.exists(key_path):
+            logging.error("The service account key file or folder {} does not exist".format(key_path))
+            return False
+    # Check that the number of workers is a positive integer
+    if inputs.workers is None or inputs.workers < 1:
+        logging.error("The number of workers specified with the '-w' or '--workers' flag must be at least 1")
+        return False
+    # Check that the request quota is a positive integer
+    if inputs.requests_per_minute is None or inputs.requests_per_minute < 1:
+        logging.error("The request quota specified with the '-r' or '--requests-per-minute' flag must be at least 1")
+        return False
+    # Check that the download chunk size is a positive integer
+    if inputs.chunk_size is None or inputs.chunk_size < 1:
+        logging.error("The chunk size specified with the '-c' or '--chunk-size' flag must be at least 1 MiB")
+        return False
+    # Check that the number of connections per file is a positive integer
+    if inputs.connections is None or inputs.connections < 1:
+        logging.error("The number of connections specified with the '-n' or '--connections' flag must be at least 1")
+        return False
+    # Check that a distributed download has a shard queue and that the queue folder exists
+    if inputs.role:
+        if not inputs.queue:
+            logging.error("A shard queue file must be specified with the '--queue' flag")
+            return False
+        elif not os.path.isdir(os.path.dirname(os.path.abspath(inputs.queue))):
+            logging.error("The folder of the specified shard queue file does not exist")
+            return False
     # Returns true after all verifications are completed
     return True
 
 
 def main(inputs):
-    # Create service account credentials
-    credentials = authenticate_service_account()
-    # Create Google Drive API connection using service account credentials
-    api = API(credentials)
-    # Loop through each provided Google ID
-    for folder_id in inputs.google_id:
-        # Get file metadata array using the current Google ID
-        inventory = get_folder_contents(api, folder_id)
-        # Generate a file inventory report using the file metadata array
-        if inventory:
-            generate_inventory_report(inventory, inputs.output_dir)
+    # The asyncio client depends on aiohttp, which is not installed with the other requirements
+    if inputs.async_client and importlib.util.find_spec('aiohttp') is None:
+        logging.error("The asyncio client requires the aiohttp package, install it with 'pip install aiohttp~=3.8.1'")
+        return
+    # Create the credentials of each service account
+    credentials = authenticate_service_accounts(inputs.service_account)
+    report_path = None
+    if inputs.async_client:
+        # The asyncio client sends every request from the first service account
+        scheduler = RequestScheduler(inputs.requests_per_minute)
+        import asyncio
+        report_path = asyncio.run(inventory_folders_async(credentials[0], scheduler, inputs))
+        instrumentation = scheduler.instrumentation
+        log_summary = scheduler.log_summary
+    else:
+        # Create a Google Drive API connection that spreads the requests over the service accounts, each worker gets its
+        # own connection for each account
+        api = PooledAPI(credentials, inputs.requests_per_minute)
+        # Loop through each provided Google ID
+        for folder_id in inputs.google_id:
+            # Get file metadata array using the current Google ID
+            inventory = get_folder_contents(api, folder_id, inputs.workers)
+            # Generate a file inventory report using the file metadata array
+            if inventory:
+                report_path = generate_inventory_report(inventory, inputs.output_dir, inputs.report_format)
+        instrumentation = api.instrumentation
+        log_summary = api.log_summary
+    # Write the performance metrics of the run next to the last report
+    if report_path:
+        instrumentation.export(report_path, inputs.metrics)
+    # Print the API request statistics of the run
+    log_summary()
+
+
+async def inventory_folders_async(credentials, scheduler, inputs):
+    """
+    Generates an inventory report for each provided Google ID using the asyncio Google Drive client
+    :param credentials: Credentials used to connect to the Google Drive API
+    :param scheduler: The request scheduler of the run
+    :param inputs: The command line arguments
+    :return: The path of the last report, or None if no report was written
+    """
+    # Imported here so that aiohttp is only required when the asyncio client is used
+    from async_drive_api import AsyncAPI
+    report_path = None
+    async with AsyncAPI(credentials, scheduler=scheduler, max_connections=inputs.workers) as api:
+        # Loop through each provided Google ID
+        for folder_id in inputs.google_id:
+            # Get file metadata array using the current Google ID
+            inventory = await get_folder_contents_async(api, folder_id, inputs.workers)
+            # Generate a file inventory report using the file metadata array
+            if inventory:
+                report_path = generate_inventory_report(inventory, inputs.output_dir, inputs.report_format)
+    return report_path
 
 
 if __name__ == '__main__':
     # Configure logger
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', datefmt='%Y-%m-%d %H:%M:%S', level=logging.INFO)
     # Parse and verify command line arguments
-    args = parse_arguments()
+    args = parse_arguments(async_client=True)
     if verify_args(args):
         main(args)
@@ -1,19 +1,170 @@
-from oauth2client import file, client, tools
-from oauth2client.service_account import ServiceAccountCredentials
+import datetime
 import json
+import logging
+import os
+import threading
 
+# oauth2client is imported where it is used so that the entry points start quickly
+
+# Service account key file used if no key files are specified
+DEFAULT_KEY_FILE = 'auth/client_secrets.json'
 # Google API scopes
 SCOPES = [
     "https://www.googleapis.com/auth/drive.readonly"
 ]
+# File in which access tokens are cached so that later runs can reuse them instead of requesting a new token
+TOKEN_CACHE_PATH = 'auth/token_cache.json'
+# Number of seconds before its expiry after which a cached access token is no longer reused
+TOKEN_EXPIRY_MARGIN = 300
+# Format of the token expiry times in the token cache
+TOKEN_EXPIRY_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+def authenticate_service_accounts(key_paths=None):
+    """
+    Create a credentials object for each of the specified service account key files, a folder is replaced by the
+    service account key files it contains
+    :param key_paths: The paths of the key files or folders, defaults to 'auth/client_secrets.json'
+    :return: The list of generated credentials objects
+    """
+    key_files = []
+    for key_path in key_paths or [DEFAULT_KEY_FILE]:
+        if os.path.isdir(key_path):
+            key_files.extend(
+                os.path.join(key_path, name) for name in sorted(os.listdir(key_path))
+                if is_service_account_key(os.path.join(key_path, name))
+            )
+        else:
+            key_files.append(key_path)
+    return [authenticate_service_account(key_file) for key_file in key_files]
 
 
-def authenticate_service_account():
+def is_service_account_key(path):
     """
-    Create a service account credentials object from the 'auth/client_secrets.json'
+    Checks if a file is a service account key file, as opposed to the other files kept in the 'auth' folder
+    :param path: The path of the file
+    :return: Boolean result of the check
+    """
+    if not path.endswith('.json'):
+        return False
+    try:
+        with open(path) as f:
+            return json.load(f).get('type') == 'service_account'
+    except (OSError, ValueError, AttributeError):
+        return False
+
+
+def authenticate_service_account(key_file=DEFAULT_KEY_FILE):
+    """
+    Create a service account credentials object from a key file, a still valid access token cached by a previous run
+    is reused and every new access token is cached
+    :param key_file: The path of the service account key file
     :return: The generated credentials object
     """
-    return ServiceAccountCredentials.from_json_keyfile_name('auth/client_secrets.json', SCOPES)
+    from oauth2client.service_account import ServiceAccountCredentials
+    credentials = ServiceAccountCredentials.from_json_keyfile_name(key_file, SCOPES)
+    # Reuse the cached access token and cache the new token every time the credentials are refreshed
+    token_cache = TokenCache(TOKEN_CACHE_PATH, "{} {}".format(credentials.service_account_email, ' '.join(SCOPES)))
+    token_cache.load(credentials)
+    credentials.set_store(token_cache)
+    return credentials
+
+
+class TokenCache:
+
+    def __init__(self, path, key):
+        """
+        Initialize a cache of the access token of a service account, the token is kept in a JSON file shared by every
+        run and the private key is never written to the cache, the cache implements the oauth2client storage methods
+        used when credentials are refreshed
+        :param path: The path of the token cache file
+        :param key: The key of the service account and scopes in the token cache file
+        """
+        self.path = path
+        self.key = key
+        self.lock = threading.Lock()
+
+    def read(self):
+        """
+        Reads the token cache file
+        :return: The map of keys to cached tokens, empty if the file does not exist or cannot be read
+        """
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def write(self, tokens):
+        """
+        Replaces the token cache file atomically, as several runs may write it at the same time
+        :param tokens: The map of keys to cached tokens
+        """
+        temp_path = "{}.{}".format(self.path, os.getpid())
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(tokens, f)
+        os.replace(temp_path, self.path)
+
+    def load(self, credentials):
+        """
+        Sets the cached access token on the credentials if it is not about to expire
+        :param credentials: The credentials object
+        """
+        token = self.read().get(self.key)
+        if not token:
+            return
+        # Refresh the token before it expires rather than in the middle of a transfer
+        expiry = datetime.datetime.strptime(token['token_expiry'], TOKEN_EXPIRY_FORMAT)
+        expiry -= datetime.timedelta(seconds=TOKEN_EXPIRY_MARGIN)
+        if expiry > datetime.datetime.utcnow():
+            credentials.access_token = token['access_token']
+            credentials.token_expiry = expiry
+
+    def acquire_lock(self):
+        """
+        Acquires the lock held while the credentials are refreshed
+        """
+        self.lock.acquire()
+
+    def release_lock(self):
+        """
+        Releases the lock held while the credentials are refreshed
+        """
+        self.lock.release()
+
+    def locked_get(self):
+        """
+        Returns no credentials, as the cache only holds access tokens which are loaded when the run starts
+        :return: None
+        """
+        return None
+
+    def locked_put(self, credentials):
+        """
+        Caches the access token of refreshed credentials
+        :param credentials: The refreshed credentials object
+        """
+        if not credentials.access_token or not credentials.token_expiry:
+            return
+        try:
+            tokens = self.read()
+            tokens[self.key] = {
+                'access_token': credentials.access_token,
+                'token_expiry': credentials.token_expiry.strftime(TOKEN_EXPIRY_FORMAT)
+            }
+            self.write(tokens)
+        except OSError as ex:
+            logging.warning("Unable to cache the access token")
+            logging.warning(ex)
+
+    def locked_delete(self):
+        """
+        Removes the cached access token of revoked credentials
+        """
+        tokens = self.read()
+        if tokens.pop(self.key, None) is not None:
+            self.write(tokens)
 
 
 def authenticate_user_account():
@@ -21,6 +172,7 @@ def authenticate_user_account():
     Create an OAuth2.0 credentials object from the 'auth/client_secrets.json'
     :return: The generated credentials object
     """
+    from oauth2client import file, client, tools
     # Checks to see if there is a saved authentication token
     store = file.Storage('auth/storage.json').get()
     creds = store.get()
@@ -1,10 +1,17 @@
+import concurrent.futures
 import datetime
+import hashlib
+import json
 import logging
-from dateutil import tz
+import os
+import random
+import socket
+import threading
+import time
 
-from googleapiclient import discovery
-from googleapiclient.http import MediaIoBaseDownload
-from httplib2 import Http
+# The Google API client and httplib2 are imported where they are used so that the entry points start quickly
+from googleapiclient.errors import HttpError
+from instrumentation import *
 
 # Google Drive object metadata attribute keys
 GOOGLE_FILE_NAME = "name"
@@ -13,9 +20,65 @@ GOOGLE_FILE_MD5 = "md5Checksum"
 GOOGLE_FILE_SIZE = "size"
 GOOGLE_FILE_MIMETYPE = "mimeType"
 GOOGLE_FILE_LAST_MODIFIED = "modifiedTime"
+GOOGLE_FILE_PARENTS = "parents"
+GOOGLE_FILE_TRASHED = "trashed"
 GOOGLE_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
-# Google Drive API files list page size
-PAGE_SIZE = 100
+# Google Drive file specific metadata attribute keys
+FILE_FIELDS = [
+    GOOGLE_FILE_NAME,
+    GOOGLE_FILE_ID,
+    GOOGLE_FILE_MD5,
+    GOOGLE_FILE_SIZE,
+    GOOGLE_FILE_LAST_MODIFIED
+]
+# Google Drive API files list page size, this is the maximum page size allowed by the API
+PAGE_SIZE = 1000
+# Google Drive API root URL, the Drive API and batch endpoints are relative to this URL, it can be overridden with
+# the GOOGLE_DRIVE_ROOT_URL environment variable to use a proxy or a local test server
+ROOT_URL = os.environ.get("GOOGLE_DRIVE_ROOT_URL", "https://www.googleapis.com/")
+DRIVE_API_PATH = "drive/v3/"
+# Google Drive API discovery document URL, the document is only fetched if the Google API client does not include it
+DISCOVERY_URL = "https://www.googleapis.com/discovery/v1/apis/drive/v3/rest"
+# Path of the on-disk copy of a fetched discovery document, reused by later runs
+DISCOVERY_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'drive.v3.json')
+BATCH_PATH = "batch/drive/v3"
+# Maximum number of sub-requests allowed in a single Google Drive API batch request
+BATCH_SIZE = 100
+BYTES_IN_MIB = 1048576
+# Default size in bytes of the byte range requested by each download request
+CHUNK_SIZE = 100 * BYTES_IN_MIB
+# Suffix of the partial file a download is written to until it completes
+PART_SUFFIX = ".part"
+# Block size used when hashing the existing contents of a resumed partial file
+HASH_BLOCK_SIZE = 8 * BYTES_IN_MIB
+# Suffix of the file recording the byte ranges of a parallel download that have been written to the partial file
+RANGES_SUFFIX = ".ranges"
+# Suffix of the file recording the checksum, modified time and size of the version of the file being downloaded to the
+# partial file
+VERSION_SUFFIX = ".version"
+# Default number of connections used to download a single large file and the size in bytes above which they are used
+CONNECTIONS = 4
+PARALLEL_THRESHOLD = 1024 * BYTES_IN_MIB
+# Default Google Drive API request quota of the project
+QUOTA_REQUESTS_PER_MINUTE = 12000
+# Maximum number of times a request is retried after a retryable error
+MAX_RETRIES = 8
+# Base and maximum delay in seconds of the exponential backoff between retries
+BACKOFF_BASE = 1
+BACKOFF_MAX = 64
+# HTTP status codes and 403 error reasons that are retried with backoff
+RETRYABLE_STATUS_CODES = [429, 500, 502, 503, 504]
+RETRYABLE_REASONS = ["userRateLimitExceeded", "rateLimitExceeded"]
+# Error reasons caused by the quota of a single account, a pool of accounts sends the request again from another account,
+# the download quota of a single file (downloadQuotaExceeded) and the daily quota of the project (dailyLimitExceeded) are
+# not account quotas so they fail the request without putting the account in cooldown
+QUOTA_REASONS = RETRYABLE_REASONS + ["quotaExceeded"]
+# Base and maximum number of seconds an account of a pool is not used after a quota error, the time is doubled for each
+# consecutive quota error of the account
+ACCOUNT_COOLDOWN_BASE = 30
+ACCOUNT_COOLDOWN_MAX = 900
+# API methods that always use the first account of a pool, as changes page tokens belong to the account that created them
+PINNED_METHODS = ['get_start_page_token', 'get_changes']
 
 
 def google_time_string_to_datetime(input_time):
@@ -29,20 +92,298 @@ def google_time_string_to_datetime(input_time):
     # Parse time string into datetime object
     time = datetime.datetime.strptime(time_string, GOOGLE_TIME_FORMAT)
     # Set datetime timezone property as UTC
-    time = time.replace(tzinfo=tz.tzutc())
+    time = time.replace(tzinfo=datetime.timezone.utc)
     # Convert time from UTC to local
-    time = time.astimezone(tz.tzlocal())
+    time = time.astimezone()
     return time
 
 
+# The discovery document loaded by this process, shared by every API connection
+discovery_document = None
+discovery_lock = threading.Lock()
+
+
+def get_discovery_document():
+    """
+    Returns the Google Drive API discovery document, which is loaded once per process from the copy included in the
+    Google API client or from the on-disk cache, and only fetched from Google if neither is available
+    :return: The discovery document JSON string
+    """
+    global discovery_document
+    with discovery_lock:
+        if discovery_document is None:
+            try:
+                from googleapiclient.discovery_cache import get_static_doc
+                discovery_document = get_static_doc('drive', 'v3')
+            except ImportError:
+                pass
+        if discovery_document is None and os.path.exists(DISCOVERY_CACHE_PATH):
+            with open(DISCOVERY_CACHE_PATH) as f:
+                discovery_document = f.read()
+        if discovery_document is None:
+            from httplib2 import Http
+            logging.info("Fetching the Google Drive API discovery document")
+            response, content = Http().request(DISCOVERY_URL)
+            if response.status >= 300:
+                raise HttpError(response, content, uri=DISCOVERY_URL)
+            discovery_document = content.decode()
+            # Write the cache atomically as several runs may fetch the document at the same time
+            os.makedirs(os.path.dirname(DISCOVERY_CACHE_PATH), exist_ok=True)
+            temp_path = "{}.{}".format(DISCOVERY_CACHE_PATH, os.getpid())
+            with open(temp_path, 'w') as f:
+                f.write(discovery_document)
+            os.replace(temp_path, DISCOVERY_CACHE_PATH)
+        return discovery_document
+
+
+def is_retryable_error(error):
+    """
+    Determines if a failed request should be retried after a backoff delay
+    :param error: The exception raised by the failed request
+    :return: Boolean result of the determination
+    """
+    # Network errors are always retried
+    if not isinstance(error, HttpError):
+        return isinstance(error, (ConnectionError, socket.timeout))
+    # A malformed batch response has no status
+    if error.resp is None:
+        return False
+    status = error.resp.status
+    if status in RETRYABLE_STATUS_CODES:
+        return True
+    # A 403 status is only retried if it was caused by rate limiting and not by a permission or quota error
+    if status == 403:
+        return any(reason in RETRYABLE_REASONS for reason in get_error_reasons(error))
+    return False
+
+
+def get_error_reasons(error):
+    """
+    Returns the reasons given in a Google API error response
+    :param error: The HttpError raised by the failed request
+    :return: The list of error reasons, empty if the response has none
+    """
+    try:
+        return [item.get("reason") for item in json.loads(error.content.decode())["error"]["errors"]]
+    except Exception:
+        return []
+
+
+def is_quota_error(error):
+    """
+    Determines if a failed request was rejected because of the rate limit or the quota of the account that sent it
+    :param error: The exception raised by the failed request
+    :return: Boolean result of the determination
+    """
+    if not isinstance(error, HttpError) or error.resp is None:
+        return False
+    if error.resp.status == 429:
+        return True
+    return error.resp.status == 403 and any(reason in QUOTA_REASONS for reason in get_error_reasons(error))
+
+
+class RequestScheduler:
+
+    def __init__(self, requests_per_minute=QUOTA_REQUESTS_PER_MINUTE, max_retries=MAX_RETRIES, instrumentation=None,
+                 retry_quota_errors=True):
+        """
+        Initialize a thread-safe request scheduler that limits the request rate to the project quota with a token
+        bucket and retries rate limited and failed requests with exponential backoff and jitter
+        :param requests_per_minute: The request quota of the project
+        :param max_retries: The maximum number of times a request is retried
+        :param instrumentation: The run instrumentation in which requests are measured, a new one is created if omitted
+        :param retry_quota_errors: If false, requests rejected by the account quota are not retried so that a pool of
+        accounts can send them from another account
+        """
+        self.instrumentation = instrumentation if instrumentation else Instrumentation()
+        self.retry_quota_errors = retry_quota_errors
+        self.rate = requests_per_minute / 60
+        # The bucket holds at most one second of requests so that bursts stay within the quota
+        self.capacity = max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.max_retries = max_retries
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.throttle_time = 0.0
+        self.backoff_time = 0.0
+
+    def acquire(self, count=1):
+        """
+        Takes the specified number of tokens from the bucket, waiting until they are available if necessary
+        :param count: The number of requests that are about to be sent
+        """
+        delay = self.reserve(count)
+        if delay > 0:
+            time.sleep(delay)
+
+    def reserve(self, count=1):
+        """
+        Takes the specified number of tokens from the bucket without waiting for them to become available
+        :param count: The number of requests that are about to be sent
+        :return: The time in seconds the caller must wait before sending the requests
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+            # Reserve the tokens, a negative balance is the time until the reserved tokens become available
+            self.tokens -= count
+            self.requests += count
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+            self.throttle_time += delay
+        self.instrumentation.increment(API_REQUESTS, count)
+        if delay > 0:
+            self.instrumentation.increment(THROTTLE_SECONDS, delay)
+        return delay
+
+    def backoff(self, attempt, error):
+        """
+        Waits for an exponentially increasing, randomized amount of time before a request is retried
+        :param attempt: The number of times the request has already been retried
+        :param error: The error that caused the retry
+        """
+        time.sleep(self.reserve_backoff(attempt, error))
+
+    def reserve_backoff(self, attempt, error):
+        """
+        Records a retry and returns the exponentially increasing, randomized time to wait before it is sent
+        :param attempt: The number of times the request has already been retried
+        :param error: The error that caused the retry
+        :return: The time in seconds the caller must wait before retrying the request
+        """
+        delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+        with self.lock:
+            self.retries += 1
+            self.backoff_time += delay
+        self.instrumentation.increment(API_RETRIES)
+        self.instrumentation.increment(BACKOFF_SECONDS, delay)
+        logging.warning("Retrying request in {:.1f} seconds after error: {}".format(delay, error))
+        return delay
+
+    def execute(self, function, count=1, metric=API_REQUEST_SECONDS):
+        """
+        Calls the provided request function within the rate limit, retrying it if it fails with a retryable error
+        :param function: The function that sends the request and returns its result
+        :param count: The number of requests sent by the function
+        :param metric: The name of the histogram in which the duration of each attempt is recorded
+        :return: The result of the function
+        """
+        attempt = 0
+        while True:
+            self.acquire(count)
+            start_time = time.monotonic()
+            try:
+                result = function()
+            except Exception as ex:
+                self.record_request(metric, time.monotonic() - start_time, ex)
+                if attempt >= self.max_retries or not is_retryable_error(ex):
+                    raise
+                if not self.retry_quota_errors and is_quota_error(ex):
+                    raise
+                self.backoff(attempt, ex)
+                attempt += 1
+                continue
+            self.record_request(metric, time.monotonic() - start_time)
+            return result
+
+    def record_request(self, metric, duration, error=None):
+        """
+        Records the duration of a request attempt and whether it failed
+        :param metric: The name of the histogram in which the duration is recorded
+        :param duration: The duration of the attempt in seconds
+        :param error: The error raised by the attempt if it failed
+        """
+        self.instrumentation.observe(metric, duration)
+        if error is not None:
+            self.instrumentation.increment(API_ERRORS)
+
+    def log_summary(self, prefix=""):
+        """
+        Logs the number of requests, retries and the time spent throttled or backing off during this run
+        :param prefix: The text logged before the summary
+        """
+        with self.lock:
+            logging.info(
+                "{}Sent {} API requests, {} retries, {:.1f} seconds throttled by the rate limit, "
+                "{:.1f} seconds of retry backoff".format(
+                    prefix, self.requests, self.retries, self.throttle_time, self.backoff_time
+                )
+            )
+
+
+class HashingWriter:
+
+    def __init__(self, file):
+        """
+        Wraps a binary file handle so that an MD5 checksum of everything written to it is calculated as it is written
+        :param file: The binary file handle to wrap
+        """
+        self.file = file
+        self.md5 = hashlib.md5()
+
+    def hash_existing(self):
+        """
+        Adds the bytes already present in the file to the checksum, used when appending to a resumed partial file
+        """
+        self.file.seek(0)
+        data = self.file.read(HASH_BLOCK_SIZE)
+        while data:
+            self.md5.update(data)
+            data = self.file.read(HASH_BLOCK_SIZE)
+
+    def write(self, data):
+        """
+        Writes the data to the file and adds it to the checksum
+        :param data: The bytes to write
+        :return: The number of bytes written
+        """
+        self.md5.update(data)
+        return self.file.write(data)
+
+    def hexdigest(self):
+        """
+        Returns the MD5 checksum of the file contents written so far
+        :return: The hexadecimal MD5 checksum string
+        """
+        return self.md5.hexdigest()
+
+
 class API:
 
-    def __init__(self, credentials):
+    def __init__(self, credentials, root_url=ROOT_URL, scheduler=None, chunk_size=CHUNK_SIZE,
+                 connections=CONNECTIONS, parallel_threshold=PARALLEL_THRESHOLD):
         """
         Establish a Google Drive API connection using the provided credentials
         :param credentials: Credentials used to connect to the Google Drive API
+        :param root_url: The root URL of the Google Drive API and batch endpoints
+        :param scheduler: The request scheduler shared by all connections of this run, a new one is created if omitted
+        :param chunk_size: The size in bytes of the byte range requested by each download request
+        :param connections: The number of connections used to download a single large file
+        :param parallel_threshold: The file size in bytes above which a file is downloaded over multiple connections
         """
-        self.connection = discovery.build('drive', 'v3', http=credentials.authorize(Http()))
+        self.credentials = credentials
+        self.scheduler = scheduler if scheduler else RequestScheduler()
+        self.instrumentation = self.scheduler.instrumentation
+        self.chunk_size = chunk_size
+        self.connections = connections
+        self.parallel_threshold = parallel_threshold
+        self.batch_uri = root_url + BATCH_PATH
+        from googleapiclient import discovery
+        from httplib2 import Http
+        # Build the connection from the discovery document loaded once per process instead of fetching it
+        self.connection = discovery.build_from_document(
+            get_discovery_document(),
+            http=credentials.authorize(Http()),
+            client_options={'api_endpoint': root_url + DRIVE_API_PATH}
+        )
+
+    def log_summary(self):
+        """
+        Logs the API request statistics of the run
+        """
+        self.scheduler.log_summary()
 
     def get_folder_by_id(self, resource_id):
         """
@@ -50,7 +391,7 @@ class API:
         :param resource_id: Google ID associated with the desired metadata
         :return: Metadata map for the provided Google ID's associated object
         """
-        return self.connection.files().get(fileId=resource_id).execute()
+        return self.scheduler.execute(self.connection.files().get(fileId=resource_id).execute)
 
     def get_file_by_id(self, resource_id):
         """
@@ -58,33 +399,75 @@ class API:
         :param resource_id: Google ID associated with the desired metadata
         :return: Metadata map for the provided Google ID's associated object
         """
-        return self.connection.files().get(
+        return self.scheduler.execute(self.connection.files().get(
             fileId=resource_id,
-            fields=','.join(
-                [
-                    GOOGLE_FILE_NAME,
-                    GOOGLE_FILE_ID,
-                    GOOGLE_FILE_MD5,
-                    GOOGLE_FILE_SIZE,
-                    GOOGLE_FILE_LAST_MODIFIED
-                ]
-            )
-        ).execute()
+            fields=','.join(FILE_FIELDS)
+        ).execute)
+
+    def get_files_by_ids(self, resource_ids):
+        """
+        Returns file specific metadata for each of the provided Google IDs' associated objects, the lookups are sent
+        in batch requests of up to BATCH_SIZE sub-requests each
+        :param resource_ids: Google IDs associated with the desired metadata
+        :return: A tuple of a map of Google IDs to metadata maps and a map of Google IDs to the errors of failed lookups
+        """
+        files = {}
+        errors = {}
+
+        def callback(request_id, response, exception):
+            if exception is not None:
+                errors[request_id] = exception
+            else:
+                files[request_id] = response
+
+        from googleapiclient.http import BatchHttpRequest
+        # Remove duplicate IDs as the sub-request IDs of a batch must be unique
+        resource_ids = list(dict.fromkeys(resource_ids))
+        attempt = 0
+        while True:
+            for i in range(0, len(resource_ids), BATCH_SIZE):
+                batch = BatchHttpRequest(callback=callback, batch_uri=self.batch_uri)
+                batch_ids = resource_ids[i:i + BATCH_SIZE]
+                for resource_id in batch_ids:
+                    batch.add(
+                        self.connection.files().get(fileId=resource_id, fields=','.join(FILE_FIELDS)),
+                        request_id=resource_id
+                    )
+                # Every sub-request counts against the request quota, a batch request that fails as a whole fails
+                # each of its lookups
+                try:
+                    self.scheduler.execute(batch.execute, len(batch_ids))
+                except HttpError as error:
+                    for resource_id in batch_ids:
+                        errors[resource_id] = error
+            # Retry the sub-requests that failed with a retryable error
+            resource_ids = [resource_id for resource_id in errors if is_retryable_error(errors[resource_id])]
+            if not resource_ids or attempt >= self.scheduler.max_retries:
+                break
+            self.scheduler.backoff(attempt, errors[resource_ids[0]])
+            for resource_id in resource_ids:
+                del errors[resource_id]
+            attempt += 1
+        return files, errors
 
     def get_children_by_id(self, resource_id):
         """
-        Returns an array of the default metadata for all children of the the provided Google ID's associated object
+        Returns an array of the file specific metadata and MIME type for all children of the the provided Google ID's
+        associated object
         :param resource_id: Google ID associated with the desired children's parent object
         :return: Metadata map array for the provided Google ID's associated object's children
         """
         files = []
         npt = None
+        # Request the file specific attributes in the list call so that each child does not need to be queried again
+        fields = "nextPageToken,files({})".format(','.join(FILE_FIELDS + [GOOGLE_FILE_MIMETYPE]))
         while True:
-            result = self.connection.files().list(
+            result = self.scheduler.execute(self.connection.files().list(
                 q="'{}' in parents".format(resource_id),
+                fields=fields,
                 pageToken=npt,
                 pageSize=PAGE_SIZE
-            ).execute()
+            ).execute)
             files.extend(result['files'])
             if 'nextPageToken' in result:
                 npt = result['nextPageToken']
@@ -92,24 +475,444 @@ class API:
                 break
         return files
 
-    def download_file(self, path, google_id):
+    def get_start_page_token(self):
+        """
+        Returns the Google Drive changes page token of the current state of the Drive
+        :return: The page token from which later changes can be listed
+        """
+        return self.scheduler.execute(self.connection.changes().getStartPageToken().execute)['startPageToken']
+
+    def get_changes(self, page_token):
+        """
+        Returns all changes to the Drive since the provided page token was issued
+        :param page_token: The page token returned by a previous call to this method or get_start_page_token
+        :return: A tuple of the array of changes and the page token from which later changes can be listed
+        """
+        changes = []
+        fields = "nextPageToken,newStartPageToken,changes(fileId,removed,file({}))".format(
+            ','.join(FILE_FIELDS + [GOOGLE_FILE_MIMETYPE, GOOGLE_FILE_PARENTS, GOOGLE_FILE_TRASHED])
+        )
+        while True:
+            result = self.scheduler.execute(self.connection.changes().list(
+                pageToken=page_token,
+                fields=fields,
+                pageSize=PAGE_SIZE
+            ).execute)
+            changes.extend(result['changes'])
+            if 'nextPageToken' in result:
+                page_token = result['nextPageToken']
+            else:
+                return changes, result['newStartPageToken']
+
+    def download_file(self, path, google_id, size=None, md5=None, modified_time=None):
         """
-        Downloads a file with the specified Google ID from Google Drive and saves it at the specified path
+        Downloads a file with the specified Google ID from Google Drive and saves it at the specified path, the file is
+        written to a partial file first and a download interrupted by a previous run resumes where it stopped if the
+        file has not changed since
         :param path: The path to which the file is saved
         :param google_id: The Google ID of the target file
+        :param size: The size of the target file, if known files above the parallel threshold use multiple connections
+        :param md5: The MD5 checksum of the target file, a resumed download that does not match it starts over
+        :param modified_time: The modified time of the target file as a POSIX timestamp
+        :return: The MD5 checksum calculated while downloading, or None if the file was downloaded out of order
         """
         # Create the download request
         request = self.connection.files().get_media(fileId=google_id)
+        part_path = path + PART_SUFFIX
+        resumed = self.check_partial_file(part_path, size, md5, modified_time)
+        calculated_md5 = None
+        if size is not None and size > self.parallel_threshold and self.connections > 1 and hasattr(os, 'pwrite'):
+            self.download_parallel(request, part_path, size)
+            # Hash a resumed download so that a corrupt partial file is detected before it is moved to its final path
+            if resumed and md5 is not None:
+                with open(part_path, 'rb') as f:
+                    writer = HashingWriter(f)
+                    writer.hash_existing()
+                calculated_md5 = writer.hexdigest()
+        else:
+            calculated_md5 = self.download_sequential(request, part_path)
+        # The bytes kept from the interrupted download may be corrupt, in which case the whole file is downloaded again
+        if resumed and md5 is not None and calculated_md5 is not None and calculated_md5 != md5:
+            logging.warning("Restarting download as the resumed file does not match its checksum")
+            self.remove_partial_file(part_path)
+            return self.download_file(path, google_id, size, md5, modified_time)
+        # Move the completed download to its final path
+        os.replace(part_path, path)
+        os.remove(part_path + VERSION_SUFFIX)
+        return calculated_md5
+
+    def check_partial_file(self, part_path, size, md5, modified_time):
+        """
+        Checks that the partial file of an interrupted download was written from the current version of the file and
+        is not larger than the file, otherwise it is discarded, and records the current version of the file
+        :param part_path: The path of the partial file
+        :param size: The size of the target file
+        :param md5: The MD5 checksum of the target file
+        :param modified_time: The modified time of the target file as a POSIX timestamp
+        :return: Boolean result of the check, true if the download resumes from the partial file
+        """
+        version_path = part_path + VERSION_SUFFIX
+        version = {GOOGLE_FILE_MD5: md5, GOOGLE_FILE_LAST_MODIFIED: modified_time, GOOGLE_FILE_SIZE: size}
+        if os.path.exists(part_path):
+            recorded = None
+            if os.path.exists(version_path):
+                try:
+                    with open(version_path) as f:
+                        recorded = json.load(f)
+                except ValueError:
+                    pass
+            if recorded != version:
+                logging.info("Restarting download as the partial file was written from another version of the file")
+            elif size is not None and os.path.getsize(part_path) > size:
+                logging.info("Restarting download as the partial file is larger than the file")
+            else:
+                return True
+            self.remove_partial_file(part_path)
+        # Record the version before the partial file is written
+        with open(version_path, 'w') as f:
+            json.dump(version, f)
+        return False
+
+    @staticmethod
+    def remove_partial_file(part_path):
+        """
+        Removes the partial file of a download along with its ranges and version files
+        :param part_path: The path of the partial file
+        """
+        for path in [part_path, part_path + RANGES_SUFFIX, part_path + VERSION_SUFFIX]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def download_sequential(self, request, part_path):
+        """
+        Downloads a file one byte range at a time over this API connection, appending each range to the partial file
+        :param request: The media download request of the file
+        :param part_path: The path of the partial file
+        :return: The MD5 checksum of the downloaded file
+        """
+        # A partial file written by a parallel download is not contiguous and cannot be appended to
+        ranges_path = part_path + RANGES_SUFFIX
+        if os.path.exists(ranges_path):
+            os.remove(part_path)
+            os.remove(ranges_path)
+        # The size of the partial file is the byte offset at which the download resumes
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if offset > 0:
+            logging.info("Resuming download at byte {}".format(offset))
         # Create the initial last progress update time
         last_update = datetime.datetime.now()
-        # Download the file
-        with open(path, 'wb') as f:
-            downloader = MediaIoBaseDownload(f, request)
+        # Download the file one byte range at a time, calculating the MD5 checksum as each range is written
+        with open(part_path, 'a+b') as f:
+            writer = HashingWriter(f)
+            if offset > 0:
+                writer.hash_existing()
             done = False
-            # Print out the download progress if it has not been printed in the last 30 seconds
+            # Print out the download progress if it has not been printed in the last 15 seconds
             while done is False:
-                status, done = downloader.next_chunk()
+                content, total_size = self.scheduler.execute(
+                    lambda: self.download_range(request.http, request, offset, offset + self.chunk_size - 1),
+                    metric=DOWNLOAD_RANGE_SECONDS
+                )
+                write_start = time.monotonic()
+                writer.write(content)
+                # Persist the chunk so that the partial file size is a valid resume offset after a crash
+                f.flush()
+                os.fsync(f.fileno())
+                self.instrumentation.observe(DISK_WRITE_SECONDS, time.monotonic() - write_start)
+                self.instrumentation.increment(DOWNLOADED_BYTES, len(content))
+                offset += len(content)
+                done = offset >= total_size or len(content) == 0
                 delta = datetime.datetime.now() - last_update
                 if delta.seconds > 15:
                     last_update = datetime.datetime.now()
-                    logging.info("Download %d%%." % int(status.progress() * 100))
+                    logging.info("Download %d%%." % int(offset * 100 / max(total_size, 1)))
+        return writer.hexdigest()
+
+    def download_parallel(self, request, part_path, size):
+        """
+        Downloads a file as byte ranges fetched concurrently over multiple connections, each range is written in place
+        into the preallocated partial file and recorded in a ranges file so an interrupted download can be resumed
+        :param request: The media download request of the file
+        :param part_path: The path of the partial file
+        :param size: The size of the file
+        """
+        ranges_path = part_path + RANGES_SUFFIX
+        ranges = [(start, min(start + self.chunk_size, size) - 1) for start in range(0, size, self.chunk_size)]
+        # Find the ranges completed by a previous run
+        completed = set()
+        if os.path.exists(part_path):
+            if os.path.exists(ranges_path):
+                completed = self.read_ranges(ranges_path)
+                # Ranges recorded with another chunk size do not line up with the current ranges, so the preallocated
+                # bytes they do not cover cannot be told apart from downloaded bytes and the download starts over
+                if not completed <= set(ranges):
+                    logging.info("Restarting download as its byte ranges do not match the current chunk size")
+                    os.remove(part_path)
+                    os.remove(ranges_path)
+                    completed = set()
+            else:
+                # A partial file written by a sequential download is complete up to its size
+                part_size = os.path.getsize(part_path)
+                completed = {(start, end) for start, end in ranges if end < part_size}
+        remaining = [byte_range for byte_range in ranges if byte_range not in completed]
+        if completed:
+            logging.info("Resuming download with {} of {} byte ranges completed".format(len(completed), len(ranges)))
+        from httplib2 import Http
+        # Each download thread uses its own HTTP connection as httplib2 connections are not thread-safe
+        local = threading.local()
+        lock = threading.Lock()
+        progress = {
+            'downloaded': sum(end - start + 1 for start, end in completed), 'last_update': datetime.datetime.now()
+        }
+        fd = os.open(part_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            # Preallocate the file so every range can be written at its offset
+            os.ftruncate(fd, size)
+            with open(ranges_path, 'a') as ranges_file:
+
+                def download_worker(byte_range):
+                    if not hasattr(local, 'http'):
+                        local.http = self.credentials.authorize(Http())
+                    start, end = byte_range
+                    content, _ = self.scheduler.execute(
+                        lambda: self.download_range(local.http, request, start, end),
+                        metric=DOWNLOAD_RANGE_SECONDS
+                    )
+                    if len(content) != end - start + 1:
+                        raise IOError("Received {} bytes for byte range {}-{}".format(len(content), start, end))
+                    # Write the range in place, a single write to a regular file may be partial
+                    write_start = time.monotonic()
+                    view = memoryview(content)
+                    written = 0
+                    while written < len(view):
+                        written += os.pwrite(fd, view[written:], start + written)
+                    # Persist the range before recording it as completed
+                    os.fsync(fd)
+                    self.instrumentation.observe(DISK_WRITE_SECONDS, time.monotonic() - write_start)
+                    self.instrumentation.increment(DOWNLOADED_BYTES, len(content))
+                    with lock:
+                        ranges_file.write("{} {}\n".format(start, end))
+                        ranges_file.flush()
+                        progress['downloaded'] += len(content)
+                        delta = datetime.datetime.now() - progress['last_update']
+                        if delta.seconds > 15:
+                            progress['last_update'] = datetime.datetime.now()
+                            logging.info("Download %d%%." % int(min(progress['downloaded'], size) * 100 / size))
+
+                with concurrent.futures.ThreadPoolExecutor(max_workers=self.connections) as executor:
+                    for future in [executor.submit(download_worker, byte_range) for byte_range in remaining]:
+                        future.result()
+        finally:
+            os.close(fd)
+        os.remove(ranges_path)
+
+    @staticmethod
+    def read_ranges(ranges_path):
+        """
+        Reads the byte ranges recorded in the ranges file of a parallel download
+        :param ranges_path: The path of the ranges file
+        :return: The set of inclusive start and end offset tuples
+        """
+        with open(ranges_path) as f:
+            return {tuple(int(value) for value in line.split()) for line in f if line.strip()}
+
+    @staticmethod
+    def download_range(http, request, start, end):
+        """
+        Downloads the specified inclusive byte range of a media download request
+        :param http: The authorized HTTP connection used to send the request
+        :param request: The media download request
+        :param start: The first byte of the range
+        :param end: The last byte of the range
+        :return: A tuple of the downloaded bytes and the total size of the file
+        """
+        headers = dict(request.headers)
+        headers['range'] = 'bytes={}-{}'.format(start, end)
+        response, content = http.request(request.uri, request.method, headers=headers)
+        # A range starting at the end of the file is not satisfiable, which means there is nothing left to download
+        if response.status == 416 and 'content-range' in response:
+            return b'', int(response['content-range'].rsplit('/', 1)[1])
+        if response.status >= 300:
+            raise HttpError(response, content, uri=request.uri)
+        if 'content-range' in response:
+            return content, int(response['content-range'].rsplit('/', 1)[1])
+        # The server ignored the range and returned the whole file
+        return content[start:end + 1], len(content)
+
+
+class ThreadSafeAPI:
+
+    def __init__(self, credentials, **kwargs):
+        """
+        Wraps the API class so that every thread using this object is given its own Google Drive API connection, as
+        the underlying httplib2 connection is not thread-safe
+        :param credentials: Credentials used to connect to the Google Drive API
+        :param kwargs: Keyword arguments passed to each API connection, all connections share one request scheduler
+        """
+        kwargs.setdefault('scheduler', RequestScheduler())
+        self.credentials = credentials
+        self.kwargs = kwargs
+        self.scheduler = kwargs['scheduler']
+        self.instrumentation = self.scheduler.instrumentation
+        self.local = threading.local()
+
+    def __getattr__(self, name):
+        """
+        Forwards attribute lookups to the API connection of the calling thread, creating the connection if necessary
+        :param name: The name of the requested API attribute
+        :return: The requested attribute of the calling thread's API connection
+        """
+        api = getattr(self.local, 'api', None)
+        if api is None:
+            api = API(self.credentials, **self.kwargs)
+            self.local.api = api
+        return getattr(api, name)
+
+
+class PooledAccount:
+    """
+    The state of a service account in a pool of accounts
+    """
+    __slots__ = ['name', 'api', 'in_flight', 'quota_errors', 'cooldown_until']
+
+    def __init__(self, name, api):
+        """
+        Initialize the state of a service account
+        :param name: The name of the account used in log messages
+        :param api: The thread-safe Google Drive API connection of the account
+        """
+        self.name = name
+        self.api = api
+        self.in_flight = 0
+        self.quota_errors = 0
+        self.cooldown_until = 0.0
+
+
+class PooledAPI:
+
+    def __init__(self, credentials, requests_per_minute=QUOTA_REQUESTS_PER_MINUTE, **kwargs):
+        """
+        Spreads Google Drive API calls over several service accounts, each account has its own request scheduler so
+        that its request rate is tracked separately, a call rejected by the quota of an account is sent again from
+        another account and the account is not used until its cooldown has passed
+        :param credentials: The credentials of each service account
+        :param requests_per_minute: The request quota of each account
+        :param kwargs: Keyword arguments passed to each API connection
+        """
+        self.instrumentation = Instrumentation()
+        # A single account retries its own quota errors as there is no other account to fail over to
+        failover = len(credentials) > 1
+        self.accounts = []
+        for i, account_credentials in enumerate(credentials):
+            scheduler = RequestScheduler(
+                requests_per_minute, instrumentation=self.instrumentation, retry_quota_errors=not failover
+            )
+            name = getattr(account_credentials, 'service_account_email', None) or "account {}".format(i + 1)
+            self.accounts.append(PooledAccount(name, ThreadSafeAPI(account_credentials, scheduler=scheduler, **kwargs)))
+        self.lock = threading.Lock()
+        self.next_account = 0
+
+    def acquire_account(self):
+        """
+        Chooses the account that sends the next call, the available account with the fewest calls in progress is
+        chosen in turn, and if every account is cooling down the caller waits for the first one to become available
+        :return: The chosen account
+        """
+        with self.lock:
+            now = time.monotonic()
+            # Start the search at a different account each time so that idle accounts are used in turn
+            accounts = self.accounts[self.next_account:] + self.accounts[:self.next_account]
+            self.next_account = (self.next_account + 1) % len(self.accounts)
+            available = [account for account in accounts if account.cooldown_until <= now]
+            if available:
+                account = min(available, key=lambda candidate: candidate.in_flight)
+            else:
+                account = min(accounts, key=lambda candidate: candidate.cooldown_until)
+            account.in_flight += 1
+            delay = account.cooldown_until - now
+        if delay > 0:
+            logging.warning("Every account exceeded its quota, waiting {:.1f} seconds".format(delay))
+            self.instrumentation.increment(THROTTLE_SECONDS, delay)
+            time.sleep(delay)
+        return account
+
+    def release_account(self, account, quota_error=False):
+        """
+        Records that a call sent by an account has finished
+        :param account: The account that sent the call
+        :param quota_error: If true the call was rejected by the quota of the account, which starts its cooldown
+        """
+        with self.lock:
+            account.in_flight -= 1
+            if quota_error:
+                account.quota_errors += 1
+                cooldown = min(ACCOUNT_COOLDOWN_MAX, ACCOUNT_COOLDOWN_BASE * 2 ** (account.quota_errors - 1))
+                account.cooldown_until = time.monotonic() + cooldown
+            else:
+                account.quota_errors = 0
+
+    def call(self, name, *args, **kwargs):
+        """
+        Calls an API method from one of the accounts, failing over to another account if the call is rejected by the
+        quota of the account
+        :param name: The name of the API method
+        :param args: The positional arguments of the method
+        :param kwargs: The keyword arguments of the method
+        :return: The result of the method
+        """
+        if name in PINNED_METHODS:
+            return self.call_pinned(name, *args, **kwargs)
+        attempt = 0
+        while True:
+            account = self.acquire_account()
+            try:
+                result = getattr(account.api, name)(*args, **kwargs)
+            except Exception as ex:
+                quota_error = is_quota_error(ex)
+                self.release_account(account, quota_error)
+                if not quota_error or len(self.accounts) == 1 or attempt >= MAX_RETRIES * len(self.accounts):
+                    raise
+                logging.warning("{} exceeded its quota, sending the request from another account".format(account.name))
+                self.instrumentation.increment(ACCOUNT_FAILOVERS)
+                attempt += 1
+                continue
+            self.release_account(account)
+            return result
+
+    def call_pinned(self, name, *args, **kwargs):
+        """
+        Calls an API method from the first account, the schedulers of a pool do not retry quota errors so a call that
+        cannot fail over is retried with backoff here
+        :param name: The name of the API method
+        :param args: The positional arguments of the method
+        :param kwargs: The keyword arguments of the method
+        :return: The result of the method
+        """
+        api = self.accounts[0].api
+        attempt = 0
+        while True:
+            try:
+                return getattr(api, name)(*args, **kwargs)
+            except Exception as ex:
+                if len(self.accounts) == 1 or not is_quota_error(ex) or attempt >= MAX_RETRIES:
+                    raise
+                api.scheduler.backoff(attempt, ex)
+                attempt += 1
+
+    def __getattr__(self, name):
+        """
+        Returns a function that calls the named API method from one of the accounts, only the public methods of the API
+        class are forwarded
+        :param name: The name of the API method
+        :return: The function calling the method
+        """
+        if name.startswith('_') or not callable(getattr(API, name, None)):
+            raise AttributeError("'{}' object has no attribute '{}'".format(type(self).__name__, name))
+        return lambda *args, **kwargs: self.call(name, *args, **kwargs)
+
+    def log_summary(self):
+        """
+        Logs the API request statistics of each account
+        """
+        for account in self.accounts:
+            account.api.scheduler.log_summary("{}: ".format(account.name) if len(self.accounts) > 1 else "")
@@ -0,0 +1,293 @@
+import bisect
+import csv
+import json
+import logging
+import os
+import threading
+import time
+
+# Histograms of durations in seconds
+API_REQUEST_SECONDS = "api_request_seconds"
+DOWNLOAD_RANGE_SECONDS = "download_range_seconds"
+DISK_WRITE_SECONDS = "disk_write_seconds"
+FILE_DOWNLOAD_SECONDS = "file_download_seconds"
+FILE_VERIFY_SECONDS = "file_verify_seconds"
+# Counters
+API_REQUESTS = "api_requests"
+API_ERRORS = "api_errors"
+API_RETRIES = "api_retries"
+ACCOUNT_FAILOVERS = "account_failovers"
+THROTTLE_SECONDS = "throttle_seconds"
+BACKOFF_SECONDS = "backoff_seconds"
+DOWNLOADED_BYTES = "downloaded_bytes"
+DOWNLOADED_FILES = "downloaded_files"
+VERIFIED_BYTES = "verified_bytes"
+VERIFIED_FILES = "verified_files"
+MATCHED_FILES = "matched_files"
+DEDUPLICATED_BYTES = "deduplicated_bytes"
+DEDUPLICATED_FILES = "deduplicated_files"
+# Gauges
+FOLDER_QUEUE_DEPTH = "folder_queue_depth"
+DOWNLOAD_QUEUE_DEPTH = "download_queue_depth"
+# Upper bounds in seconds of the histogram buckets
+DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600]
+# Quantiles included in the run summary
+QUANTILES = [0.5, 0.9, 0.99]
+# Formats in which the run metrics can be exported
+JSON_FORMAT = 'json'
+CSV_FORMAT = 'csv'
+PROMETHEUS_FORMAT = 'prometheus'
+METRICS_FORMATS = [JSON_FORMAT, CSV_FORMAT, PROMETHEUS_FORMAT]
+# Prefix of the metric names in the Prometheus export
+PROMETHEUS_PREFIX = "bento_file_transfer_"
+
+
+class Histogram:
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        """
+        Initialize a histogram that counts observations in fixed buckets, so that its size does not grow with the
+        number of observations
+        :param buckets: The sorted upper bounds of the buckets
+        """
+        self.buckets = buckets
+        # The last count is for observations larger than every bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        """
+        Adds an observation to the histogram
+        :param value: The observed value
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+        """
+        Estimates a quantile of the observations as the upper bound of the bucket that contains it
+        :param q: The quantile between 0 and 1
+        :return: The estimated quantile, or None if there are no observations
+        """
+        if self.count == 0:
+            return None
+        target = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        """
+        Returns the statistics of the histogram
+        :return: A map of statistic names to values
+        """
+        summary = {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max
+        }
+        for q in QUANTILES:
+            summary['p{}'.format(int(q * 100))] = self.quantile(q)
+        return summary
+
+
+class Gauge:
+
+    def __init__(self):
+        """
+        Initialize a gauge that keeps the last, maximum and average of the values it is set to
+        """
+        self.last = None
+        self.max = None
+        self.sum = 0
+        self.samples = 0
+
+    def set(self, value):
+        """
+        Sets the current value of the gauge
+        :param value: The current value
+        """
+        self.last = value
+        self.max = value if self.max is None else max(self.max, value)
+        self.sum += value
+        self.samples += 1
+
+    def summary(self):
+        """
+        Returns the statistics of the gauge
+        :return: A map of statistic names to values
+        """
+        return {
+            'last': self.last,
+            'max': self.max,
+            'mean': self.sum / self.samples if self.samples else None
+        }
+
+
+class Instrumentation:
+
+    def __init__(self):
+        """
+        Initialize a thread-safe collection of the histograms, counters and gauges measured during a run
+        """
+        self.lock = threading.Lock()
+        self.start_time = time.monotonic()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def observe(self, name, value):
+        """
+        Adds an observation to a histogram
+        :param name: The name of the histogram
+        :param value: The observed value
+        """
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def increment(self, name, amount=1):
+        """
+        Increments a counter
+        :param name: The name of the counter
+        :param amount: The amount by which the counter is incremented
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_gauge(self, name, value):
+        """
+        Sets the current value of a gauge
+        :param name: The name of the gauge
+        :param value: The current value
+        """
+        with self.lock:
+            gauge = self.gauges.get(name)
+            if gauge is None:
+                gauge = self.gauges[name] = Gauge()
+            gauge.set(value)
+
+    def summary(self):
+        """
+        Returns the run summary including the throughput derived from the counters and histograms, downloads are
+        network bound when the download range throughput is close to the overall throughput and disk bound when the
+        disk write throughput is
+        :return: The run summary map
+        """
+        with self.lock:
+            elapsed_time = time.monotonic() - self.start_time
+            downloaded_bytes = self.counters.get(DOWNLOADED_BYTES, 0)
+            throughput = {
+                'download_bytes_per_second': downloaded_bytes / elapsed_time if elapsed_time > 0 else None,
+                'download_files_per_second':
+                    self.counters.get(DOWNLOADED_FILES, 0) / elapsed_time if elapsed_time > 0 else None
+            }
+            # The throughput of a single connection or disk while it is busy
+            for name, histogram in [
+                ('download_range_bytes_per_second', self.histograms.get(DOWNLOAD_RANGE_SECONDS)),
+                ('disk_write_bytes_per_second', self.histograms.get(DISK_WRITE_SECONDS))
+            ]:
+                throughput[name] = downloaded_bytes / histogram.sum if histogram and histogram.sum > 0 else None
+            verify_histogram = self.histograms.get(FILE_VERIFY_SECONDS)
+            throughput['verify_bytes_per_second'] = (
+                self.counters.get(VERIFIED_BYTES, 0) / verify_histogram.sum
+                if verify_histogram and verify_histogram.sum > 0 else None
+            )
+            return {
+                'elapsed_seconds': elapsed_time,
+                'throughput': throughput,
+                'counters': dict(self.counters),
+                'histograms': {name: histogram.summary() for name, histogram in self.histograms.items()},
+                'gauges': {name: gauge.summary() for name, gauge in self.gauges.items()}
+            }
+
+    def export(self, report_path, formats):
+        """
+        Writes the run metrics next to the inventory report in each of the specified formats
+        :param report_path: The path of the inventory report
+        :param formats: The formats in which the metrics are written
+        """
+        base_path = os.path.splitext(report_path)[0]
+        summary = self.summary()
+        for metrics_format in formats:
+            try:
+                if metrics_format == JSON_FORMAT:
+                    path = base_path + '.metrics.json'
+                    with open(path, 'w') as f:
+                        json.dump(summary, f, indent=2)
+                elif metrics_format == CSV_FORMAT:
+                    path = base_path + '.metrics.csv'
+                    self.write_csv(path, summary)
+                else:
+                    path = base_path + '.prom'
+                    self.write_prometheus(path)
+                logging.info("Writing run metrics {}".format(path))
+            except Exception as ex:
+                logging.error("An error occurred while writing the {} run metrics".format(metrics_format))
+                logging.error(ex)
+
+    @staticmethod
+    def write_csv(path, summary):
+        """
+        Writes the run summary as a CSV file with one row per statistic
+        :param path: The path of the CSV file
+        :param summary: The run summary map
+        """
+        with open(path, 'w') as csvfile:
+            csvwriter = csv.writer(csvfile, lineterminator='\n')
+            csvwriter.writerow(["Group", "Metric", "Statistic", "Value"])
+            csvwriter.writerow(["run", "elapsed_seconds", "value", summary['elapsed_seconds']])
+            for name, value in summary['throughput'].items():
+                csvwriter.writerow(["throughput", name, "value", value])
+            for name, value in summary['counters'].items():
+                csvwriter.writerow(["counter", name, "value", value])
+            for group in ['histograms', 'gauges']:
+                for name, statistics in summary[group].items():
+                    for statistic, value in statistics.items():
+                        csvwriter.writerow([group[:-1], name, statistic, value])
+
+    def write_prometheus(self, path):
+        """
+        Writes the metrics in the Prometheus text exposition format, for example to be collected by the node exporter
+        textfile collector
+        :param path: The path of the metrics file
+        """
+        lines = []
+        with self.lock:
+            for name, value in sorted(self.counters.items()):
+                metric = PROMETHEUS_PREFIX + name + "_total"
+                lines.append("# TYPE {} counter".format(metric))
+                lines.append("{} {}".format(metric, value))
+            for name, gauge in sorted(self.gauges.items()):
+                metric = PROMETHEUS_PREFIX + name
+                lines.append("# TYPE {} gauge".format(metric))
+                lines.append("{} {}".format(metric, gauge.last))
+            for name, histogram in sorted(self.histograms.items()):
+                metric = PROMETHEUS_PREFIX + name
+                lines.append("# TYPE {} histogram".format(metric))
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append('{}_bucket{{le="{}"}} {}'.format(metric, bound, cumulative))
+                lines.append('{}_bucket{{le="+Inf"}} {}'.format(metric, histogram.count))
+                lines.append("{}_sum {}".format(metric, histogram.sum))
+                lines.append("{}_count {}".format(metric, histogram.count))
+        # Replace the file atomically so that the textfile collector never reads a partially written file, the
+        # temporary file name does not end in .prom so it is not collected
+        temp_path = "{}.{}".format(path, os.getpid())
+        with open(temp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(temp_path, path)
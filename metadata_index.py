@@ -0,0 +1,351 @@
+import sqlite3
+import threading
+import time
+from folder_inventory import *
+
+
+class MetadataIndex:
+
+    def __init__(self, path):
+        """
+        Opens or creates a SQLite index of the Google Drive metadata of previously inventoried folders, the index is
+        kept up to date with the Google Drive changes API so that repeat inventories do not traverse the whole folder
+        :param path: The file path of the SQLite database
+        """
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS sync_state (root_id TEXT PRIMARY KEY, page_token TEXT NOT NULL)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS folders ("
+                "root_id TEXT NOT NULL, id TEXT NOT NULL, parent_id TEXT, path TEXT NOT NULL, "
+                "PRIMARY KEY (root_id, id))"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "root_id TEXT NOT NULL, id TEXT NOT NULL, path TEXT NOT NULL, name TEXT NOT NULL, size INTEGER, "
+                "md5 TEXT, modified_time REAL, downloaded_md5 TEXT, verified_mtime REAL, "
+                "PRIMARY KEY (root_id, id))"
+            )
+            # Indexes created before the local modified time of verified files was recorded are upgraded
+            columns = [row[1] for row in self.connection.execute("PRAGMA table_info(files)")]
+            if 'verified_mtime' not in columns:
+                self.connection.execute("ALTER TABLE files ADD COLUMN verified_mtime REAL")
+
+    def close(self):
+        """
+        Closes the database connection
+        """
+        self.connection.close()
+
+    def sync(self, api, folder_id, workers=DEFAULT_WORKERS):
+        """
+        Brings the index of the specified folder up to date and returns its inventory, a folder that has not been
+        indexed yet is traversed in full while an indexed folder only applies the changes since the last sync
+        :param api: The Google Drive API connection object
+        :param folder_id: The Google Drive id of the folder to inventory
+        :param workers: The maximum number of folders that are listed concurrently during a full traversal
+        :return: A list of file records for all files in the folder, or None if the folder could not be accessed
+        """
+        row = self.connection.execute("SELECT page_token FROM sync_state WHERE root_id = ?", (folder_id,)).fetchone()
+        if row is None:
+            if not self.full_sync(api, folder_id, workers):
+                return None
+        else:
+            logging.info("Applying changes since the last sync of folder {}".format(folder_id))
+            changes, page_token = api.get_changes(row[0])
+            with self.lock, self.connection:
+                new_folders = self.apply_changes(folder_id, changes)
+                # The existing contents of a folder moved into the indexed folder produce no changes so it is listed
+                self.index_folders(api, folder_id, new_folders)
+                self.connection.execute(
+                    "UPDATE sync_state SET page_token = ? WHERE root_id = ?", (page_token, folder_id)
+                )
+            logging.info("Applied {} changes".format(len(changes)))
+        return self.get_inventory(folder_id)
+
+    def full_sync(self, api, folder_id, workers):
+        """
+        Traverses the specified folder and replaces its index entries
+        :param api: The Google Drive API connection object
+        :param folder_id: The Google Drive id of the folder to inventory
+        :param workers: The maximum number of folders that are listed concurrently
+        :return: Boolean result of the traversal
+        """
+        # Get the page token before traversing so that changes made during the traversal are applied by the next sync
+        page_token = api.get_start_page_token()
+        folders = []
+        inventory = get_folder_contents(api, folder_id, workers, folders)
+        if inventory is None:
+            return False
+        with self.lock, self.connection:
+            # Keep the checksums and local modified times of the files that were already downloaded
+            downloaded = {
+                file_id: (downloaded_md5, verified_mtime) for file_id, downloaded_md5, verified_mtime in
+                self.connection.execute(
+                    "SELECT id, downloaded_md5, verified_mtime FROM files WHERE root_id = ?", (folder_id,)
+                )
+            }
+            self.connection.execute("DELETE FROM folders WHERE root_id = ?", (folder_id,))
+            self.connection.execute("DELETE FROM files WHERE root_id = ?", (folder_id,))
+            self.connection.executemany(
+                "INSERT INTO folders VALUES (?, ?, ?, ?)",
+                [(folder_id, folder[GOOGLE_FILE_ID], folder.get(PARENT_ID), folder[FILE_PATH]) for folder in folders]
+            )
+            self.connection.executemany(
+                "INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        folder_id, file.google_id, file.path, file.name, file.size, file.md5, file.modified_time,
+                        *downloaded.get(file.google_id, (None, None))
+                    )
+                    for file in inventory
+                ]
+            )
+            self.connection.execute("INSERT OR REPLACE INTO sync_state VALUES (?, ?)", (folder_id, page_token))
+        return True
+
+    def apply_changes(self, root_id, changes):
+        """
+        Applies Google Drive changes to the index of the specified folder, a change to an object whose parent folder
+        is not indexed yet is applied again after the other changes, as the parent may be created or moved into the
+        indexed folder by a later change in the list
+        :param root_id: The Google Drive id of the indexed folder
+        :param changes: The changes returned by the Google Drive changes API
+        :return: The metadata of the folders that were not in the index before the changes, including their paths
+        """
+        new_folders = []
+        pending = changes
+        while pending:
+            deferred = [change for change in pending if not self.apply_change(root_id, change, new_folders)]
+            if len(deferred) == len(pending):
+                break
+            pending = deferred
+        # Objects whose parent is still not indexed are not inside the indexed folder, including objects moved out of it
+        for change in pending:
+            self.remove(root_id, change['fileId'])
+        return new_folders
+
+    def apply_change(self, root_id, change, new_folders):
+        """
+        Applies a single Google Drive change to the index of the specified folder
+        :param root_id: The Google Drive id of the indexed folder
+        :param change: The change returned by the Google Drive changes API
+        :param new_folders: The array to which the metadata of a folder that was not in the index is appended
+        :return: Boolean result of the change, false if the parent folder of the object is not indexed
+        """
+        file_id = change['fileId']
+        google_file = change.get('file')
+        # Removed and trashed objects are deleted from the index along with their contents
+        if change.get('removed') or not google_file or google_file.get(GOOGLE_FILE_TRASHED):
+            self.remove(root_id, file_id)
+            return True
+        # The indexed folder itself can only be renamed
+        if file_id == root_id:
+            self.move_folder(root_id, file_id, google_file[GOOGLE_FILE_NAME])
+            return True
+        parent = None
+        for parent_id in google_file.get(GOOGLE_FILE_PARENTS, []):
+            parent = self.connection.execute(
+                "SELECT id, path FROM folders WHERE root_id = ? AND id = ?", (root_id, parent_id)
+            ).fetchone()
+            if parent:
+                break
+        if parent is None:
+            return False
+        path = "{}/{}".format(parent[1], google_file[GOOGLE_FILE_NAME])
+        if google_file[GOOGLE_FILE_MIMETYPE] == FOLDER_TYPE:
+            indexed = self.connection.execute(
+                "SELECT 1 FROM folders WHERE root_id = ? AND id = ?", (root_id, file_id)
+            ).fetchone()
+            if indexed:
+                self.move_folder(root_id, file_id, path)
+            else:
+                google_file[FILE_PATH] = path
+                new_folders.append(google_file)
+            self.connection.execute(
+                "INSERT OR REPLACE INTO folders VALUES (?, ?, ?, ?)", (root_id, file_id, parent[0], path)
+            )
+        else:
+            self.index_file(root_id, create_file_metadata(google_file, path))
+        return True
+
+    def index_file(self, root_id, file):
+        """
+        Adds a file to the index of the specified folder or updates its entry, keeping the checksum it had when it was
+        last downloaded
+        :param root_id: The Google Drive id of the indexed folder
+        :param file: The record of the file
+        """
+        self.connection.execute(
+            "INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, NULL, NULL) "
+            "ON CONFLICT (root_id, id) DO UPDATE SET "
+            "path = excluded.path, name = excluded.name, size = excluded.size, md5 = excluded.md5, "
+            "modified_time = excluded.modified_time",
+            (
+                root_id, file.google_id, file.path, file.name, file.size, file.md5, file.modified_time
+            )
+        )
+
+    def index_folders(self, api, root_id, new_folders):
+        """
+        Lists the folders that were moved into or created in the indexed folder and indexes their contents
+        :param api: The Google Drive API connection object
+        :param root_id: The Google Drive id of the indexed folder
+        :param new_folders: The metadata of the folders including their paths
+        """
+        listed_paths = []
+        for folder in sorted(new_folders, key=lambda folder: folder[FILE_PATH]):
+            # A folder inside another new folder is listed along with it
+            if any(folder[FILE_PATH].startswith(path + '/') for path in listed_paths):
+                continue
+            listed_paths.append(folder[FILE_PATH])
+            logging.info("Listing folder {} added to the indexed folder".format(folder[FILE_PATH]))
+            pending = [folder]
+            while pending:
+                files, sub_folders = get_folder_children(api, pending.pop())
+                for file in files:
+                    self.index_file(root_id, file)
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO folders VALUES (?, ?, ?, ?)",
+                    [
+                        (root_id, sub_folder[GOOGLE_FILE_ID], sub_folder[PARENT_ID], sub_folder[FILE_PATH])
+                        for sub_folder in sub_folders
+                    ]
+                )
+                pending.extend(sub_folders)
+
+    def move_folder(self, root_id, folder_id, path):
+        """
+        Updates the path of an indexed folder and the paths of everything inside it
+        :param root_id: The Google Drive id of the indexed folder
+        :param folder_id: The Google Drive id of the moved or renamed folder
+        :param path: The new path of the folder
+        """
+        row = self.connection.execute(
+            "SELECT path FROM folders WHERE root_id = ? AND id = ?", (root_id, folder_id)
+        ).fetchone()
+        if row is None or row[0] == path:
+            return
+        old_prefix = row[0] + '/'
+        for table in ['folders', 'files']:
+            self.connection.execute(
+                "UPDATE {} SET path = ? || substr(path, ?) "
+                "WHERE root_id = ? AND substr(path, 1, ?) = ?".format(table),
+                (path + '/', len(old_prefix) + 1, root_id, len(old_prefix), old_prefix)
+            )
+        self.connection.execute("UPDATE folders SET path = ? WHERE root_id = ? AND id = ?", (path, root_id, folder_id))
+
+    def remove(self, root_id, file_id):
+        """
+        Removes a file or a folder and everything inside it from the index
+        :param root_id: The Google Drive id of the indexed folder
+        :param file_id: The Google Drive id of the removed object
+        """
+        row = self.connection.execute(
+            "SELECT path FROM folders WHERE root_id = ? AND id = ?", (root_id, file_id)
+        ).fetchone()
+        if row is not None:
+            prefix = row[0] + '/'
+            for table in ['folders', 'files']:
+                self.connection.execute(
+                    "DELETE FROM {} WHERE root_id = ? AND substr(path, 1, ?) = ?".format(table),
+                    (root_id, len(prefix), prefix)
+                )
+            self.connection.execute("DELETE FROM folders WHERE root_id = ? AND id = ?", (root_id, file_id))
+        self.connection.execute("DELETE FROM files WHERE root_id = ? AND id = ?", (root_id, file_id))
+
+    def get_inventory(self, root_id):
+        """
+        Returns the inventory of an indexed folder
+        :param root_id: The Google Drive id of the indexed folder
+        :return: A list of file records for all files in the folder
+        """
+        access_time = time.time()
+        rows = self.connection.execute(
+            "SELECT name, id, md5, size, modified_time, path FROM files WHERE root_id = ?", (root_id,)
+        )
+        return [
+            FileRecord(name, file_id, md5, size, modified_time, path, access_time)
+            for name, file_id, md5, size, modified_time, path in rows
+        ]
+
+    def get_downloaded_files(self):
+        """
+        Returns the files of every indexed folder that are unchanged since they were last downloaded
+        :return: A list of tuples of the MD5 checksum, size and path of each file
+        """
+        with self.lock:
+            return self.connection.execute(
+                "SELECT md5, size, path FROM files WHERE downloaded_md5 IS NOT NULL AND downloaded_md5 = md5"
+            ).fetchall()
+
+    def get_downloaded_md5(self, metadata):
+        """
+        Returns the checksum a file had when it was last downloaded
+        :param metadata: Target file record
+        :return: The MD5 checksum string, or None if the file has not been downloaded before
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT downloaded_md5 FROM files WHERE id = ? AND path = ?",
+                (metadata.google_id, metadata.path)
+            ).fetchone()
+        return row[0] if row else None
+
+    def get_verified_mtime(self, metadata):
+        """
+        Returns the modified time the local copy of a file had when its checksum was last verified, a hard linked copy
+        shares the modified time of its source so it cannot be given its own Google Drive modified time
+        :param metadata: Target file record
+        :return: The POSIX timestamp, or None if the file has not been verified or has changed since
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT downloaded_md5, verified_mtime FROM files WHERE id = ? AND path = ?",
+                (metadata.google_id, metadata.path)
+            ).fetchone()
+        if row is None or row[0] is None or row[0] != metadata.md5:
+            return None
+        return row[1]
+
+    def is_unchanged(self, metadata):
+        """
+        Checks if a file has the same checksum as when it was last downloaded
+        :param metadata: Target file record
+        :return: Boolean result of the check
+        """
+        downloaded_md5 = self.get_downloaded_md5(metadata)
+        return downloaded_md5 is not None and downloaded_md5 == metadata.md5
+
+    def is_changed(self, metadata):
+        """
+        Checks if a file has a different checksum than when it was last downloaded
+        :param metadata: Target file record
+        :return: Boolean result of the check
+        """
+        downloaded_md5 = self.get_downloaded_md5(metadata)
+        return downloaded_md5 is not None and downloaded_md5 != metadata.md5
+
+    def mark_downloaded(self, metadata, path=None):
+        """
+        Records that a file was downloaded and its checksum verified
+        :param metadata: Target file record
+        :param path: If provided, the local path of the file whose modified time is recorded so that later runs can
+        match the file without reading it
+        """
+        verified_mtime = None
+        if path is not None:
+            try:
+                verified_mtime = os.stat(path).st_mtime
+            except OSError:
+                pass
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE files SET downloaded_md5 = ?, verified_mtime = ? WHERE id = ? AND path = ?",
+                (metadata.md5, verified_mtime, metadata.google_id, metadata.path)
+            )
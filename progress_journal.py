@@ -0,0 +1,206 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from file_record import FileRecord
+
+# Journal record types
+FILE_RECORD = "file"
+LISTED_RECORD = "listed"
+DONE_RECORD = "done"
+# Number of records and number of seconds after which buffered records are synced to disk
+SYNC_RECORDS = 100
+SYNC_INTERVAL = 1
+# Minimum number of completed files recorded before the journal is compacted
+COMPACT_RECORDS = 10000
+
+
+class ProgressJournal:
+
+    def __init__(self, path):
+        """
+        Opens or creates an append-only journal recording the progress of a folder transfer, one record is appended for
+        every file found by the inventory and for every completed file, an existing journal is replayed so that an
+        interrupted transfer can be resumed
+        :param path: The file path of the journal
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        # Keys of the files found by the inventory and of the completed files
+        self.found_keys = set()
+        self.done_keys = set()
+        # Records of the remaining and completed files recorded by a previous run, filled when the journal is replayed
+        self.pending = {}
+        self.downloaded = []
+        self.listed = False
+        self.unsynced_records = 0
+        self.last_sync = time.monotonic()
+        self.compacted_records = 0
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        if os.path.exists(path):
+            self.replay()
+        self.journal_file = open(path, 'a')
+
+    def replay(self):
+        """
+        Rebuilds the transfer progress from the records in the journal, a partially written last record left by a
+        crash is discarded
+        """
+        valid_size = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b'\n'):
+                    break
+                self.apply(record)
+                valid_size += len(line)
+        # Remove the partially written record so that new records are appended after the last valid record
+        if valid_size < os.path.getsize(self.path):
+            logging.warning("Discarding a partially written record at the end of {}".format(self.path))
+            with open(self.path, 'r+b') as f:
+                f.truncate(valid_size)
+
+    def apply(self, record):
+        """
+        Applies a journal record to the transfer progress
+        :param record: The journal record
+        """
+        record_type = record['type']
+        if record_type == FILE_RECORD:
+            metadata = FileRecord.from_list(record['file'])
+            key = self.get_key(metadata)
+            self.found_keys.add(key)
+            self.pending[key] = metadata
+        elif record_type == DONE_RECORD:
+            metadata = FileRecord.from_list(record['file'])
+            key = self.get_key(metadata)
+            self.done_keys.add(key)
+            self.pending.pop(key, None)
+            self.downloaded.append(metadata)
+        elif record_type == LISTED_RECORD:
+            self.listed = True
+
+    @staticmethod
+    def get_key(metadata):
+        """
+        Returns the key identifying a file within the journal
+        :param metadata: Target file record
+        :return: The key of the file
+        """
+        return "{}/{}".format(metadata.google_id, metadata.path)
+
+    def get_pending(self):
+        """
+        Returns the files found by a previous run that have not been completed
+        :return: The record array of the remaining files
+        """
+        with self.lock:
+            return list(self.pending.values())
+
+    def is_done(self, metadata):
+        """
+        Checks if a file has been completed
+        :param metadata: Target file record
+        :return: Boolean result of the check
+        """
+        with self.lock:
+            return self.get_key(metadata) in self.done_keys
+
+    def write(self, record):
+        """
+        Appends a record to the journal, records are flushed immediately and synced to disk in batches
+        :param record: The journal record
+        """
+        self.journal_file.write(json.dumps(record) + '\n')
+        self.journal_file.flush()
+        self.unsynced_records += 1
+        if self.unsynced_records >= SYNC_RECORDS or time.monotonic() - self.last_sync >= SYNC_INTERVAL:
+            self.sync()
+
+    def sync(self):
+        """
+        Syncs the appended records to disk
+        """
+        os.fsync(self.journal_file.fileno())
+        self.unsynced_records = 0
+        self.last_sync = time.monotonic()
+
+    def record_file(self, metadata):
+        """
+        Records a file found by the inventory, files that were already recorded are ignored
+        :param metadata: Target file record
+        """
+        with self.lock:
+            key = self.get_key(metadata)
+            if key not in self.found_keys:
+                self.found_keys.add(key)
+                self.write({'type': FILE_RECORD, 'file': metadata.to_list()})
+
+    def record_listed(self):
+        """
+        Records that the inventory is complete so that a resumed transfer does not need to traverse the folder again
+        """
+        with self.lock:
+            self.listed = True
+            self.write({'type': LISTED_RECORD})
+            self.sync()
+
+    def record_inventory(self, inventory):
+        """
+        Records the files found by the inventory followed by a record marking the inventory as complete
+        :param inventory: The record array of the files to be transferred
+        """
+        for metadata in inventory:
+            self.record_file(metadata)
+        self.record_listed()
+
+    def record_done(self, metadata):
+        """
+        Records that a file has been completed along with its final status
+        :param metadata: Target file record
+        """
+        with self.lock:
+            self.done_keys.add(self.get_key(metadata))
+            self.write({'type': DONE_RECORD, 'file': metadata.to_list()})
+            # Compact once the records made redundant since the last compaction outnumber the records that are kept
+            self.compacted_records += 1
+            if self.compacted_records >= max(COMPACT_RECORDS, len(self.found_keys)):
+                self.compact()
+
+    def compact(self):
+        """
+        Atomically replaces the journal with a copy that drops the file records of completed files, the journal is
+        copied record by record so that compaction does not need the record of every file in memory
+        """
+        temp_path = self.path + '.compact'
+        self.journal_file.flush()
+        with open(self.path, 'r') as journal_file, open(temp_path, 'w') as f:
+            for line in journal_file:
+                record = json.loads(line)
+                if record['type'] != FILE_RECORD:
+                    f.write(line)
+                elif self.get_key(FileRecord.from_list(record['file'])) not in self.done_keys:
+                    f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self.journal_file.close()
+        os.replace(temp_path, self.path)
+        self.journal_file = open(self.path, 'a')
+        self.unsynced_records = 0
+        self.last_sync = time.monotonic()
+        self.compacted_records = 0
+
+    def close(self):
+        """
+        Syncs and closes the journal
+        """
+        with self.lock:
+            self.sync()
+            self.journal_file.close()
@@ -0,0 +1,339 @@
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from file_record import FileRecord
+
+# Maximum number of files and total size in bytes of the files in a shard
+SHARD_FILES = 1000
+SHARD_SIZE = 10 * 1024 * 1048576
+# Number of seconds a claimed shard is leased to a worker before other workers can claim it, the lease is renewed while
+# the shard is being downloaded
+LEASE_SECONDS = 300
+# Number of completed files after which their statuses are written to the queue
+RESULT_BATCH_SIZE = 100
+# Number of seconds a connection waits for another process to release the database lock
+LOCK_TIMEOUT = 60
+# Shard statuses
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+
+
+class ShardQueue:
+
+    def __init__(self, path):
+        """
+        Opens or creates a SQLite queue of download shards kept on a file system shared by the coordinator and the
+        workers, the rollback journal is used instead of write-ahead logging as it works on network file systems
+        :param path: The file path of the SQLite database
+        """
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=LOCK_TIMEOUT, isolation_level=None, check_same_thread=False)
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                self.connection.execute(
+                    "CREATE TABLE IF NOT EXISTS roots (root_id TEXT PRIMARY KEY, listed INTEGER NOT NULL DEFAULT 0)"
+                )
+                self.connection.execute(
+                    "CREATE TABLE IF NOT EXISTS shards ("
+                    "id INTEGER PRIMARY KEY, root_id TEXT NOT NULL, status TEXT NOT NULL, worker TEXT, "
+                    "lease_expiry REAL, claims INTEGER NOT NULL DEFAULT 0)"
+                )
+                self.connection.execute(
+                    "CREATE TABLE IF NOT EXISTS files ("
+                    "root_id TEXT NOT NULL, google_id TEXT NOT NULL, path TEXT NOT NULL, shard_id INTEGER NOT NULL, "
+                    "record TEXT NOT NULL, "
+                    "PRIMARY KEY (root_id, google_id, path))"
+                )
+                self.connection.execute("CREATE INDEX IF NOT EXISTS files_shard ON files (shard_id)")
+                self.connection.execute("CREATE INDEX IF NOT EXISTS shards_status ON shards (status)")
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def close(self):
+        """
+        Closes the database connection
+        """
+        self.connection.close()
+
+    def transaction(self, function):
+        """
+        Calls a function inside a transaction that holds the database write lock, so that workers on other hosts see
+        either all or none of its changes
+        :param function: The function to call, called with no arguments
+        :return: The result of the function
+        """
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                result = function()
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+            return result
+
+    def is_listed(self, root_id):
+        """
+        Checks if the inventory of a folder has been completely published
+        :param root_id: The Google Drive id of the folder
+        :return: Boolean result of the check
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT listed FROM roots WHERE root_id = ?", (root_id,)).fetchone()
+        return bool(row and row[0])
+
+    def publish(self, root_id, files):
+        """
+        Publishes the inventory of a folder as shards of up to SHARD_FILES files and SHARD_SIZE bytes as the files are
+        found, files published by an interrupted coordinator are not published again
+        :param root_id: The Google Drive id of the folder
+        :param files: An iterable of the file records of the folder
+        :return: The number of files published
+        """
+        self.transaction(lambda: self.connection.execute("INSERT OR IGNORE INTO roots VALUES (?, 0)", (root_id,)))
+        published = 0
+        shard = []
+        shard_size = 0
+        for metadata in files:
+            shard.append(metadata)
+            shard_size += metadata.size or 0
+            if len(shard) >= SHARD_FILES or shard_size >= SHARD_SIZE:
+                published += self.transaction(lambda: self.insert_shard(root_id, shard))
+                shard = []
+                shard_size = 0
+        if shard:
+            published += self.transaction(lambda: self.insert_shard(root_id, shard))
+        self.transaction(lambda: self.connection.execute("UPDATE roots SET listed = 1 WHERE root_id = ?", (root_id,)))
+        return published
+
+    def insert_shard(self, root_id, files):
+        """
+        Inserts a shard of the files that have not been published yet, must be called inside a transaction
+        :param root_id: The Google Drive id of the folder
+        :param files: The file records of the shard
+        :return: The number of files inserted
+        """
+        shard_id = self.connection.execute(
+            "INSERT INTO shards (root_id, status) VALUES (?, ?)", (root_id, PENDING)
+        ).lastrowid
+        inserted = 0
+        for metadata in files:
+            inserted += self.connection.execute(
+                "INSERT OR IGNORE INTO files VALUES (?, ?, ?, ?, ?)",
+                (root_id, metadata.google_id, metadata.path or '', shard_id, json.dumps(metadata.to_list()))
+            ).rowcount
+        if inserted == 0:
+            self.connection.execute("DELETE FROM shards WHERE id = ?", (shard_id,))
+        return inserted
+
+    def claim(self, worker):
+        """
+        Leases a pending shard, or a shard whose lease has expired because its worker stopped, to a worker
+        :param worker: The name of the worker
+        :return: The lease of the claimed shard, or None if there is no shard to claim
+        """
+        def claim_shard():
+            now = time.time()
+            row = self.connection.execute(
+                "SELECT id FROM shards WHERE status = ? OR (status = ? AND lease_expiry < ?) ORDER BY id LIMIT 1",
+                (PENDING, LEASED, now)
+            ).fetchone()
+            if row is None:
+                return None
+            self.connection.execute(
+                "UPDATE shards SET status = ?, worker = ?, lease_expiry = ?, claims = claims + 1 WHERE id = ?",
+                (LEASED, worker, now + LEASE_SECONDS, row[0])
+            )
+            return row[0]
+
+        shard_id = self.transaction(claim_shard)
+        if shard_id is None:
+            return None
+        with self.lock:
+            records = self.connection.execute("SELECT record FROM files WHERE shard_id = ?", (shard_id,)).fetchall()
+        return ShardLease(self, shard_id, worker, [FileRecord.from_list(json.loads(record)) for record, in records])
+
+    def renew(self, shard_id, worker):
+        """
+        Extends the lease of a shard
+        :param shard_id: The id of the shard
+        :param worker: The name of the worker holding the lease
+        :return: Boolean result of the renewal, false if the lease expired and the shard was claimed by another worker
+        """
+        return self.transaction(lambda: self.connection.execute(
+            "UPDATE shards SET lease_expiry = ? WHERE id = ? AND worker = ? AND status = ?",
+            (time.time() + LEASE_SECONDS, shard_id, worker, LEASED)
+        ).rowcount > 0)
+
+    def record_results(self, shard_id, worker, files, done=False):
+        """
+        Records the final statuses of the completed files of a shard and optionally marks the shard as done, nothing is
+        recorded if the lease of the worker expired and the shard was claimed by another worker
+        :param shard_id: The id of the shard
+        :param worker: The name of the worker holding the lease
+        :param files: The completed file records
+        :param done: If true the shard is also marked as done
+        :return: Boolean result of the recording, false if the worker no longer holds the lease
+        """
+        def record():
+            leased = self.connection.execute(
+                "SELECT 1 FROM shards WHERE id = ? AND worker = ? AND status = ?", (shard_id, worker, LEASED)
+            ).fetchone()
+            if not leased:
+                return False
+            self.connection.executemany(
+                "UPDATE files SET record = ? WHERE shard_id = ? AND google_id = ? AND path = ?",
+                [
+                    (json.dumps(metadata.to_list()), shard_id, metadata.google_id, metadata.path or '')
+                    for metadata in files
+                ]
+            )
+            if done:
+                self.connection.execute(
+                    "UPDATE shards SET status = ?, lease_expiry = NULL WHERE id = ?", (DONE, shard_id)
+                )
+            return True
+
+        return self.transaction(record)
+
+    def get_progress(self):
+        """
+        Returns the number of shards in each status
+        :return: A map of shard statuses to shard counts
+        """
+        with self.lock:
+            return dict(self.connection.execute("SELECT status, COUNT(*) FROM shards GROUP BY status"))
+
+    def is_finished(self, root_ids):
+        """
+        Checks if the inventories of the specified folders have been completely published and every shard is done
+        :param root_ids: The Google Drive ids of the folders
+        :return: Boolean result of the check
+        """
+        if not all(self.is_listed(root_id) for root_id in root_ids):
+            return False
+        with self.lock:
+            remaining = self.connection.execute("SELECT COUNT(*) FROM shards WHERE status != ?", (DONE,)).fetchone()[0]
+        return remaining == 0
+
+    def iterate_results(self, root_ids):
+        """
+        Returns the final records of the files of the specified folders in the order they were published, the records
+        are read a shard at a time so that memory use does not grow with the number of files
+        :param root_ids: The Google Drive ids of the folders
+        :return: A generator of file records
+        """
+        for root_id in root_ids:
+            with self.lock:
+                shard_ids = [row[0] for row in self.connection.execute(
+                    "SELECT id FROM shards WHERE root_id = ? ORDER BY id", (root_id,)
+                )]
+            for shard_id in shard_ids:
+                with self.lock:
+                    records = self.connection.execute(
+                        "SELECT record FROM files WHERE shard_id = ? ORDER BY rowid", (shard_id,)
+                    ).fetchall()
+                for record, in records:
+                    yield FileRecord.from_list(json.loads(record))
+
+
+class ShardLease:
+
+    def __init__(self, queue, shard_id, worker, files):
+        """
+        Initialize the lease of a claimed shard, the lease takes the place of the progress journal of a download so
+        that the status of each completed file is written back to the queue, and it is renewed in the background while
+        the shard is being downloaded, once the lease is lost the lost event is set and nothing more is recorded
+        :param queue: The shard queue
+        :param shard_id: The id of the shard
+        :param worker: The name of the worker holding the lease
+        :param files: The file records of the shard
+        """
+        self.queue = queue
+        self.shard_id = shard_id
+        self.worker = worker
+        self.files = files
+        self.lock = threading.Lock()
+        self.completed = []
+        self.expiry = time.time() + LEASE_SECONDS
+        self.lost = threading.Event()
+        self.stopped = threading.Event()
+        self.renewer = threading.Thread(target=self.renew_lease, daemon=True)
+        self.renewer.start()
+
+    def renew_lease(self):
+        """
+        Renews the lease every third of the lease time until the shard is done, the lease is lost if another worker
+        claimed the shard or if it could not be renewed before it expired
+        """
+        while not self.stopped.wait(LEASE_SECONDS / 3):
+            try:
+                if self.queue.renew(self.shard_id, self.worker):
+                    self.expiry = time.time() + LEASE_SECONDS
+                    continue
+                logging.warning("The lease of shard {} expired and the shard was claimed by another worker".format(
+                    self.shard_id
+                ))
+            except sqlite3.Error as ex:
+                logging.error("An error occurred while renewing the lease of shard {}".format(self.shard_id))
+                logging.error(ex)
+                if time.time() < self.expiry:
+                    continue
+                logging.warning("The lease of shard {} expired before it could be renewed".format(self.shard_id))
+            self.lost.set()
+            return
+
+    def record_done(self, metadata):
+        """
+        Records that a file has been completed along with its final status, the statuses are written to the queue in
+        batches of RESULT_BATCH_SIZE files
+        :param metadata: Target file record
+        """
+        with self.lock:
+            if self.lost.is_set():
+                return
+            self.completed.append(metadata)
+            if len(self.completed) < RESULT_BATCH_SIZE:
+                return
+            completed = self.completed
+            self.completed = []
+        if not self.queue.record_results(self.shard_id, self.worker, completed):
+            self.lost.set()
+
+    def complete(self):
+        """
+        Writes the remaining statuses, marks the shard as done and stops renewing the lease
+        :return: Boolean result of the completion, false if the lease was lost
+        """
+        self.stopped.set()
+        with self.lock:
+            completed = self.completed
+            self.completed = []
+        if self.lost.is_set() or not self.queue.record_results(self.shard_id, self.worker, completed, done=True):
+            self.lost.set()
+            return False
+        return True
+
+    def abandon(self):
+        """
+        Stops renewing the lease without marking the shard as done, so that another worker claims it once the lease
+        expires
+        """
+        self.stopped.set()
+
+
+def get_worker_name():
+    """
+    Returns a name identifying this worker process across the hosts sharing the queue
+    :return: The worker name
+    """
+    return "{}:{}".format(socket.gethostname(), os.getpid())